@@ -0,0 +1,229 @@
+import time
+import numpy as np
+from collections import deque
+from features import SPECTRAL_FEATURES
+
+
+class SlidingWindow:
+    """
+    Fixed-length window of floats with O(1) running sum and amortised O(1)
+    running max (monotonic deque of candidate maxima).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = np.zeros(size, dtype=np.float64)
+        self.count = 0
+        self.pos = 0
+        self.total = 0.0
+        self.maxima = deque()
+        self.index = 0
+
+    def push(self, value):
+        if self.count == self.size:
+            self.total -= self.values[self.pos]
+        else:
+            self.count += 1
+        self.values[self.pos] = value
+        self.total += value
+        self.pos = (self.pos + 1) % self.size
+
+        # Resum once per wrap so floating point drift never accumulates
+        if self.pos == 0:
+            self.total = float(self.values[:self.count].sum())
+
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((self.index, value))
+        if self.maxima[0][0] <= self.index - self.size:
+            self.maxima.popleft()
+        self.index += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def max(self):
+        return self.maxima[0][1] if self.maxima else 0.0
+
+
+class SpectralFeatures:
+    """
+    Band energies, spectral centroid and spectral flux from one real FFT per
+    chunk.
+
+    Band energies are fractions of the chunk's total energy and the centroid
+    is relative to Nyquist, so all values are in [0, 1] regardless of gain.
+    Flux is the positive change of the normalised magnitude spectrum since
+    the previous chunk.
+    """
+
+    BANDS_HZ = ((0, 300), (300, 2000), (2000, 6000), (6000, None))
+
+    def __init__(self, chunk_size, rate):
+        self.window = np.hanning(chunk_size).astype(np.float32)
+        self.windowed = np.empty(chunk_size, dtype=np.float32)
+
+        n_bins = chunk_size // 2 + 1
+        freqs = np.fft.rfftfreq(chunk_size, 1.0 / rate)
+        self.rel_freqs = (freqs / (rate / 2)).astype(np.float32)
+        self.band_edges = [int(np.searchsorted(freqs, low)) for low, _ in self.BANDS_HZ] + [n_bins]
+
+        self.power = np.empty(n_bins, dtype=np.float32)
+        self.magnitude = np.empty(n_bins, dtype=np.float32)
+        self.prev_magnitude = np.zeros(n_bins, dtype=np.float32)
+        self.diff = np.empty(n_bins, dtype=np.float32)
+
+    def process(self, samples, out):
+        n = len(samples)
+        if n != len(self.window):
+            return
+        np.multiply(samples, self.window, out=self.windowed)
+        spectrum = np.fft.rfft(self.windowed)
+
+        np.abs(spectrum, out=self.magnitude)
+        np.multiply(self.magnitude, self.magnitude, out=self.power)
+        total = float(self.power.sum())
+
+        if total <= 0.0:
+            for name in SPECTRAL_FEATURES:
+                out[name] = 0.0
+            self.prev_magnitude.fill(0.0)
+            return
+
+        edges = self.band_edges
+        for i, name in enumerate(SPECTRAL_FEATURES[:4]):
+            out[name] = float(self.power[edges[i]:edges[i + 1]].sum()) / total
+
+        mag_total = float(self.magnitude.sum())
+        out['spectral_centroid'] = float(np.dot(self.rel_freqs, self.magnitude)) / mag_total
+
+        self.magnitude /= mag_total
+        np.subtract(self.magnitude, self.prev_magnitude, out=self.diff)
+        np.maximum(self.diff, 0.0, out=self.diff)
+        out['spectral_flux'] = float(self.diff.sum())
+        self.prev_magnitude, self.magnitude = self.magnitude, self.prev_magnitude
+
+
+class AudioFeatureExtractor:
+    """
+    Per-chunk RMS/ZCR with rolling window statistics.
+
+    All per-chunk buffers are preallocated. Each processed chunk publishes a
+    new snapshot dict in a single assignment, so readers always see values
+    that belong to the same chunk.
+    """
+
+    def __init__(self, chunk_size, window_chunks, rate=44100, spectral=False):
+        self.chunk_size = chunk_size
+        self.samples = np.empty(chunk_size, dtype=np.float32)
+        self.signs = np.empty(chunk_size, dtype=bool)
+        self.crossings = np.empty(chunk_size - 1, dtype=bool)
+
+        self.rms_window = SlidingWindow(max(1, window_chunks))
+        self.zcr_window = SlidingWindow(max(1, window_chunks))
+        self.spectral = SpectralFeatures(chunk_size, rate) if spectral else None
+
+        self.snapshot = {
+            'noise_rms': 0.0,
+            'noise_zcr': 0.0,
+            'peak_rms': 0.0,
+            'mean_rms': 0.0,
+            'peak_zcr': 0.0,
+            'mean_zcr': 0.0
+        }
+        if self.spectral:
+            self.snapshot.update((name, 0.0) for name in SPECTRAL_FEATURES)
+
+    def process(self, data):
+        pcm = np.frombuffer(data, dtype=np.int16)
+        n = len(pcm)
+        samples = self.samples[:n]
+        np.copyto(samples, pcm, casting='unsafe')
+
+        rms = float(np.sqrt(np.dot(samples, samples) / n)) / 32768.0
+
+        # A crossing is a change of sign bit between neighbouring samples
+        np.signbit(samples, out=self.signs[:n])
+        np.not_equal(self.signs[1:n], self.signs[:n - 1], out=self.crossings[:n - 1])
+        zcr = np.count_nonzero(self.crossings[:n - 1]) / n
+
+        self.rms_window.push(rms)
+        self.zcr_window.push(zcr)
+
+        snapshot = {
+            'noise_rms': rms,
+            'noise_zcr': zcr,
+            'peak_rms': self.rms_window.max(),
+            'mean_rms': self.rms_window.mean(),
+            'peak_zcr': self.zcr_window.max(),
+            'mean_zcr': self.zcr_window.mean()
+        }
+        if self.spectral:
+            self.spectral.process(samples, snapshot)
+
+        self.snapshot = snapshot
+        return snapshot
+
+
+class LegacyAudioFeatures:
+    """The original per-chunk computation from AudioHandler, kept for benchmarking."""
+
+    def __init__(self, window_chunks):
+        self.rms_history = deque(maxlen=window_chunks)
+        self.zcr_history = deque(maxlen=window_chunks)
+
+    def process(self, data):
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+
+        rms = np.sqrt(np.mean(samples**2)) / 32768.0
+        zero_crossings = np.sum(np.abs(np.diff(np.sign(samples)))) / 2
+        zcr = zero_crossings / len(samples)
+
+        self.rms_history.append(rms)
+        self.zcr_history.append(zcr)
+
+        return {
+            'noise_rms': float(rms),
+            'noise_zcr': float(zcr),
+            'peak_rms': float(max(self.rms_history)),
+            'mean_rms': float(np.mean(self.rms_history)),
+            'peak_zcr': float(max(self.zcr_history)),
+            'mean_zcr': float(np.mean(self.zcr_history))
+        }
+
+
+def benchmark(rate, chunk_size=1024, window_size=1.0, seconds=30):
+    window_chunks = int(window_size * rate / chunk_size)
+    n_chunks = int(seconds * rate / chunk_size)
+
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 3000, n_chunks * chunk_size).clip(-32768, 32767).astype(np.int16)
+    chunks = [noise[i * chunk_size:(i + 1) * chunk_size].tobytes() for i in range(n_chunks)]
+
+    results = {}
+    extractors = (
+        ('legacy', LegacyAudioFeatures(window_chunks)),
+        ('extractor', AudioFeatureExtractor(chunk_size, window_chunks, rate)),
+        ('spectral', AudioFeatureExtractor(chunk_size, window_chunks, rate, spectral=True))
+    )
+    for name, extractor in extractors:
+        start = time.perf_counter()
+        for chunk in chunks:
+            features = extractor.process(chunk)
+        elapsed = time.perf_counter() - start
+        results[name] = (elapsed / n_chunks * 1e6, features)
+
+    budget_us = chunk_size / rate * 1e6
+    print(f"{rate} Hz, {chunk_size}-sample chunks ({budget_us:.0f}us per chunk), window={window_chunks} chunks")
+    for name, (per_chunk, features) in results.items():
+        print(f"  {name:>9}: {per_chunk:7.1f}us/chunk ({per_chunk / budget_us * 100:.2f}% of budget) "
+              f"peak_rms={features['peak_rms']:.4f} mean_zcr={features['mean_zcr']:.4f}")
+    speedup = results['legacy'][0] / results['extractor'][0]
+    spectral_cost = results['spectral'][0] - results['extractor'][0]
+    print(f"  speedup: {speedup:.1f}x, spectral stage: {spectral_cost:.1f}us/chunk "
+          f"({spectral_cost / budget_us * 100:.2f}% of budget)")
+
+
+if __name__ == "__main__":
+    for rate in (44100, 48000):
+        benchmark(rate)
@@ -1,33 +1,25 @@
 import pyaudio
-import numpy as np
 import threading
 import os
-from collections import deque
 from dotenv import load_dotenv
+from audio_features import AudioFeatureExtractor
 
 load_dotenv()
 
 class AudioHandler:
-    def __init__(self):
+    def __init__(self, spectral=False):
         self.device = os.getenv('AUDIO_DEVICE', 'plughw:3,0')
         self.chunk_size = int(os.getenv('AUDIO_CHUNK_SIZE', 1024))
         self.rate = int(os.getenv('AUDIO_RATE', 44100))
         self.window_size = float(os.getenv('TEMPORAL_WINDOW_SIZE', 1.0))
         
-        self.rms = 0.0
-        self.zcr = 0.0
-        
         self.max_window_samples = int(self.window_size * self.rate / self.chunk_size)
-        self.rms_history = deque(maxlen=self.max_window_samples)
-        self.zcr_history = deque(maxlen=self.max_window_samples)
-        
-        self.peak_rms = 0.0
-        self.mean_rms = 0.0
-        self.peak_zcr = 0.0
-        self.mean_zcr = 0.0
+        self.extractor = AudioFeatureExtractor(self.chunk_size, self.max_window_samples,
+                                               self.rate, spectral=spectral)
         
         self.running = False
         self.thread = None
+        self.tap = None  # optional callback receiving every raw chunk
         self.audio = pyaudio.PyAudio()
         self.stream = None
         self._validate_device()
@@ -66,33 +58,15 @@ class AudioHandler:
         while self.running:
             try:
                 data = self.stream.read(self.chunk_size, exception_on_overflow=False)
-                samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
-                
-                self.rms = np.sqrt(np.mean(samples**2)) / 32768.0
-                zero_crossings = np.sum(np.abs(np.diff(np.sign(samples)))) / 2
-                self.zcr = zero_crossings / len(samples)
-                
-                self.rms_history.append(self.rms)
-                self.zcr_history.append(self.zcr)
-                
-                if len(self.rms_history) > 0:
-                    self.peak_rms = float(max(self.rms_history))
-                    self.mean_rms = float(np.mean(self.rms_history))
-                    self.peak_zcr = float(max(self.zcr_history))
-                    self.mean_zcr = float(np.mean(self.zcr_history))
-                
+                self.extractor.process(data)
+                if self.tap:
+                    self.tap(data)
             except Exception as e:
                 print(f"Audio capture error: {e}")
     
     def get_features(self):
-        return {
-            'noise_rms': float(self.rms),
-            'noise_zcr': float(self.zcr),
-            'peak_rms': float(self.peak_rms),
-            'mean_rms': float(self.mean_rms),
-            'peak_zcr': float(self.peak_zcr),
-            'mean_zcr': float(self.mean_zcr)
-        }
+        # The extractor swaps in a new snapshot per chunk, so this is consistent
+        return dict(self.extractor.snapshot)
     
     def stop(self):
         self.running = False
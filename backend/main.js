@@ -51,10 +51,30 @@ function connectToAI() {
   });
 
   aiClient.on("message", (data) => {
+    const text = data.toString();
+    let frames = [text];
+
+    // Bursts of logs arrive as one log_batch; the frontend expects single logs
+    let msg = null;
+    try {
+      msg = JSON.parse(text);
+    } catch (err) {
+      // Not JSON; forward as is
+    }
+    if (msg && msg.jsonType === "log_batch") {
+      if (!Array.isArray(msg.logs)) {
+        console.error("Bad log batch: no logs array");
+        return;
+      }
+      frames = msg.logs.map((log) => JSON.stringify(log));
+    }
+
     wssFE.clients.forEach((client) => {
       if (client.readyState === WebSocket.OPEN) {
-        console.log(data.toString());
-        client.send(data.toString());
+        frames.forEach((frame) => {
+          console.log(frame);
+          client.send(frame);
+        });
       }
     });
   });
@@ -125,6 +145,7 @@ app.post("/user/data", async (req, res) => {
     }
     fs.writeFileSync(USER_DATA_PATH, JSON.stringify(data, null, 2));
     await redisClient.set("file_changed", "true");
+    await redisClient.publish("settings_updated", JSON.stringify({ updatedAt: Date.now() }));
     res.status(200).json({ message: "User data saved" });
   } catch (err) {
     res.status(500).json({ error: "Failed to save user data" });
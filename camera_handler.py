@@ -1,86 +1,314 @@
 import cv2
+import time
+import threading
 import numpy as np
-from picamera2 import Picamera2
-from tflite_runtime.interpreter import Interpreter
+from detectors import create_detector
+from camera_source import create_camera_source, lores_shape
 from simple_facerec import SimpleFacerec
+from person_tracker import PersonTracker
+import metrics
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+class FrameRef:
+    """A frame held in a FrameRing slot; call release() when done with it."""
+
+    def __init__(self, ring, index, seq):
+        self.ring = ring
+        self.index = index
+        self.seq = seq
+        self.array = ring.buffers[index]
+        self.lores = ring.lores_buffers[index] if ring.lores_buffers else None
+
+    def release(self):
+        self.ring.release(self.index)
+
+
+class FrameRing:
+    """
+    Preallocated, reference-counted frame buffers filled by one capture
+    thread and shared by any number of readers without copying.
+
+    The writer only reuses slots that are neither the latest frame nor held
+    by a reader; if none is free the frame is dropped and counted as an
+    overrun.
+    """
+
+    def __init__(self, size, shape, lores_shape=None):
+        self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(size)]
+        self.lores_buffers = [np.empty(lores_shape, dtype=np.uint8) for _ in range(size)] if lores_shape else None
+        self.refcounts = [0] * size
+        self.seqs = [0] * size
+        self.latest = -1
+        self.seq = 0
+        self.overruns = 0
+        self.cond = threading.Condition()
+
+    def acquire_write(self):
+        with self.cond:
+            size = len(self.buffers)
+            for offset in range(1, size + 1):
+                index = (self.latest + offset) % size
+                if index != self.latest and self.refcounts[index] == 0:
+                    return index
+            self.overruns += 1
+            return None
+
+    def publish(self, index):
+        with self.cond:
+            self.seq += 1
+            self.seqs[index] = self.seq
+            self.latest = index
+            self.cond.notify_all()
+
+    def wait_newer(self, seq, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > seq, timeout):
+                return None
+            index = self.latest
+            self.refcounts[index] += 1
+            return FrameRef(self, index, self.seqs[index])
+
+    def release(self, index):
+        with self.cond:
+            self.refcounts[index] -= 1
+
+
+class FrameSubscription:
+    """Per-consumer cursor over a FrameRing that always yields the newest frame."""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.last_seq = ring.seq
+        self.skipped = 0
+
+    def next(self, timeout=1.0):
+        ref = self.ring.wait_newer(self.last_seq, timeout)
+        if ref is None:
+            return None
+        if self.last_seq:
+            self.skipped += ref.seq - self.last_seq - 1
+        self.last_seq = ref.seq
+        return ref
+
+
 class CameraHandler:
-    def __init__(self):
+    def __init__(self, capture=True):
+        # capture=False builds only the detection stages, for replaying recorded frames
         self.fps = int(os.getenv('CAMERA_FPS', 30))
         self.width = 640
         self.height = 480
         
-        self.picam2 = Picamera2()
-        config = self.picam2.create_video_configuration(
-            main={"size": (self.width, self.height), "format": "RGB888"}
-        )
-        self.picam2.configure(config)
-        self.picam2.start()
+        self.detector = create_detector()
+        self.model_width, self.model_height = self.detector.input_size
+        print(f"Person detector: {getattr(self.detector, 'description', type(self.detector).__name__)}")
         
-        self.interpreter = Interpreter(model_path="requisites/detect.tflite")
-        self.interpreter.allocate_tensors()
-        self.input_details = self.interpreter.get_input_details()
-        self.output_details = self.interpreter.get_output_details()
+        # The ISP scales a lores stream to the model input size, leaving the
+        # main stream for recording and face recognition
+        self.lores_input = capture and os.getenv('CAMERA_LORES', 'true').lower() == 'true'
+        if self.lores_input and not self.detector.accepts_lores:
+            print("Warning: detector cannot take a YUV420 lores stream, resizing main instead")
+            self.lores_input = False
+        lores_size = (self.model_width, self.model_height) if self.lores_input else None
         
-        self.model_height = self.input_details[0]['shape'][1]
-        self.model_width = self.input_details[0]['shape'][2]
+        self.source = None
+        self.ring = None
+        if capture:
+            self.source = create_camera_source(self.width, self.height, self.fps, lores_size)
+            self.source.start()
+            self.capture_into = metrics.timed('capture_frame', self.source.capture)
+            
+            ring_size = int(os.getenv('CAMERA_RING_SIZE', 8))
+            self.ring = FrameRing(ring_size, (self.height, self.width, 3),
+                                  lores_shape(lores_size) if lores_size else None)
+        self.capture_latency = 0.0
+        self.capture_total_latency = 0.0
         
         self.bg_subtractor = cv2.createBackgroundSubtractorMOG2(detectShadows=False)
         
+        # Motion runs on a downscaled grayscale copy of the frame
+        motion_scale = float(os.getenv('MOTION_SCALE', 0.25))
+        self.motion_width = max(1, int(self.width * motion_scale))
+        self.motion_height = max(1, int(self.height * motion_scale))
+        self.motion_small = np.empty((self.motion_height, self.motion_width, 3), dtype=np.uint8)
+        self.motion_gray = np.empty((self.motion_height, self.motion_width), dtype=np.uint8)
+        self.motion_mask = self._build_motion_mask()
+        if self.motion_mask is not None:
+            self.motion_masked = np.empty_like(self.motion_gray)
+            self.motion_active_pixels = max(1, cv2.countNonZero(self.motion_mask))
+        else:
+            self.motion_active_pixels = self.motion_width * self.motion_height
+        
         self.sfr = SimpleFacerec()
         if os.path.exists("images/"):
             self.sfr.load_encoding_images("images/")
+            self.sfr.start_watching(float(os.getenv('FACE_RELOAD_INTERVAL', 5.0)))
             print("Face encodings loaded")
         else:
             print("Warning: images/ directory not found")
         
-        self.PERSON_CLASS_ID = 0
-        self.CONFIDENCE_THRESHOLD = 0.5
+        self.tracker = PersonTracker(
+            reverify_frames=int(os.getenv('FACE_REVERIFY_FRAMES', 30))
+        )
         
-        print(f"Camera initialized: {self.width}x{self.height}@{self.fps}fps")
+        # 'roi' searches for faces only in the upper part of each person box
+        self.face_mode = os.getenv('FACE_DETECTION_MODE', 'roi').lower()
+        self.face_roi_fraction = float(os.getenv('FACE_ROI_FRACTION', 0.5))
+        self.face_roi_scale = float(os.getenv('FACE_ROI_SCALE', 0.5))
+        self.face_timings = {'full': [0, 0.0], 'roi': [0, 0.0]}
+        
+        # Unwrapped unless METRICS_ENABLED
+        self.detect_motion = metrics.timed('detect_motion', self.detect_motion)
+        self.detect_person = metrics.timed('detect_person', self.detect_person)
+        self.detect_faces = metrics.timed('detect_faces', self.detect_faces)
+        
+        self.running = capture
+        self.capture_thread = None
+        if capture:
+            self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+            self.capture_thread.start()
+        
+        lores = f", lores {self.model_width}x{self.model_height}" if self.lores_input else ""
+        print(f"Camera initialized: {self.width}x{self.height}@{self.fps}fps{lores}")
     
-    def capture_frame(self):
-        frame = self.picam2.capture_array()
-        return frame
+    def _capture_loop(self):
+        # Sole reader of the camera; every consumer gets frames through the ring
+        errors = 0
+        while self.running:
+            try:
+                index = self.ring.acquire_write()
+                if index is None:
+                    self.capture_into(None)
+                    continue
+                
+                lores = self.ring.lores_buffers[index] if self.lores_input else None
+                self.capture_latency = self.capture_into(self.ring.buffers[index], lores)
+                self.ring.publish(index)
+                self.capture_total_latency += self.capture_latency
+                errors = 0
+            except Exception as e:
+                # Back off so a failed camera doesn't spin the loop
+                errors += 1
+                delay = min(0.1 * 2 ** (errors - 1), 5.0)
+                print(f"Camera capture error ({errors} in a row, retrying in {delay:.1f}s): {e}")
+                time.sleep(delay)
     
-    def detect_motion(self, frame):
-        frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        fg_mask = self.bg_subtractor.apply(frame_bgr)
-        motion_pixels = cv2.countNonZero(fg_mask)
-        total_pixels = fg_mask.shape[0] * fg_mask.shape[1]
-        motion_confidence = (motion_pixels / total_pixels)
-        
-        return motion_confidence
+    def get_capture_stats(self):
+        frames = self.ring.seq
+        mean_latency = self.capture_total_latency / frames if frames else 0.0
+        return {
+            'processed': frames,
+            'last_latency_ms': self.capture_latency * 1000,
+            'mean_latency_ms': mean_latency * 1000,
+            'dropped': self.ring.overruns
+        }
+    
+    def subscribe(self):
+        return FrameSubscription(self.ring)
     
-    def detect_person(self, frame):
-        frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        frame_resized = cv2.resize(frame_bgr, (self.model_width, self.model_height))
-        input_data = np.expand_dims(frame_resized, axis=0)
+    def _build_motion_mask(self):
+        """
+        Mask of pixels that count towards motion, at motion resolution.
+        MOTION_MASK is an image whose non-zero pixels are watched;
+        MOTION_IGNORE_ZONES is a ';'-separated list of normalized
+        'x1,y1,x2,y2' rectangles to ignore. Returns None when neither is set.
+        """
+        mask_path = os.getenv('MOTION_MASK', '')
+        zones = os.getenv('MOTION_IGNORE_ZONES', '')
+        if not mask_path and not zones:
+            return None
+        
+        mask = np.full((self.motion_height, self.motion_width), 255, dtype=np.uint8)
+        if mask_path:
+            image = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                print(f"Warning: motion mask {mask_path} could not be read")
+            else:
+                image = cv2.resize(image, (self.motion_width, self.motion_height),
+                                   interpolation=cv2.INTER_NEAREST)
+                mask[image == 0] = 0
         
-        self.interpreter.set_tensor(self.input_details[0]['index'], input_data)
-        self.interpreter.invoke()
+        for zone in filter(None, zones.split(';')):
+            try:
+                x1, y1, x2, y2 = (float(v) for v in zone.split(','))
+            except ValueError:
+                print(f"Warning: invalid motion zone '{zone}'")
+                continue
+            mask[int(y1 * self.motion_height):int(y2 * self.motion_height),
+                 int(x1 * self.motion_width):int(x2 * self.motion_width)] = 0
         
-        boxes = self.interpreter.get_tensor(self.output_details[0]['index'])[0]
-        classes = self.interpreter.get_tensor(self.output_details[1]['index'])[0]
-        scores = self.interpreter.get_tensor(self.output_details[2]['index'])[0]
+        print(f"Motion mask: {cv2.countNonZero(mask)}/{mask.size} pixels watched")
+        return mask
+    
+    def detect_motion(self, frame, lores=None):
+        if lores is not None and self.lores_input:
+            # The lores Y plane is already grayscale
+            cv2.resize(lores[:self.model_height], (self.motion_width, self.motion_height),
+                       dst=self.motion_gray, interpolation=cv2.INTER_AREA)
+        else:
+            cv2.resize(frame, (self.motion_width, self.motion_height),
+                       dst=self.motion_small, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(self.motion_small, cv2.COLOR_RGB2GRAY, dst=self.motion_gray)
+        fg_mask = self.bg_subtractor.apply(self.motion_gray)
         
-        person_confidence = 0.0
-        for i in range(len(scores)):
-            if classes[i] == self.PERSON_CLASS_ID and scores[i] > self.CONFIDENCE_THRESHOLD:
-                if scores[i] > person_confidence:
-                    person_confidence = scores[i]
+        # Motion in ignored regions is dropped before it is counted
+        if self.motion_mask is not None:
+            fg_mask = cv2.bitwise_and(fg_mask, self.motion_mask, dst=self.motion_masked)
         
-        return float(person_confidence)
+        motion_pixels = cv2.countNonZero(fg_mask)
+        motion_confidence = (motion_pixels / self.motion_active_pixels)
+        
+        return motion_confidence
+    
+    def detect_person(self, frame, lores=None):
+        person_confidence, person_boxes = self.detector.detect(frame, lores if self.lores_input else None)
+        self.tracker.update(person_boxes)
+        return float(person_confidence), person_boxes
+    
+    def face_regions(self, person_boxes):
+        """Pixel (top, left, bottom, right) head regions for normalized person boxes."""
+        regions = []
+        for ymin, xmin, ymax, xmax in person_boxes:
+            top = int(max(0.0, ymin) * self.height)
+            bottom = int(min(1.0, ymin + (ymax - ymin) * self.face_roi_fraction) * self.height)
+            left = int(max(0.0, xmin) * self.width)
+            right = int(min(1.0, xmax) * self.width)
+            if bottom > top and right > left:
+                regions.append((top, left, bottom, right))
+        return regions
     
-    def detect_faces(self, frame):
+    def get_face_timings(self):
+        timings = {}
+        for mode, (count, total) in self.face_timings.items():
+            timings[mode] = {
+                'calls': count,
+                'mean_latency_ms': total / count * 1000 if count else 0.0
+            }
+        return timings
+    
+    def detect_faces(self, frame, person_boxes=None):
         if not hasattr(self.sfr, 'known_face_encodings') or len(self.sfr.known_face_encodings) == 0:
             return False, []
         
-        face_locations, face_names = self.sfr.detect_known_faces(frame)
+        # Tracked people keep the identities recognised earlier
+        if not self.tracker.needs_recognition():
+            self.tracker.recognitions_skipped += 1
+            return self.tracker.identities()
+        
+        start = time.perf_counter()
+        if self.face_mode == 'roi' and person_boxes:
+            mode = 'roi'
+            face_locations, face_names = self.sfr.detect_known_faces_in_regions(
+                frame, self.face_regions(person_boxes), self.face_roi_scale)
+        else:
+            mode = 'full'
+            face_locations, face_names = self.sfr.detect_known_faces(frame)
+        self.face_timings[mode][0] += 1
+        self.face_timings[mode][1] += time.perf_counter() - start
+        self.tracker.recognitions_run += 1
+        self.tracker.assign(face_locations, face_names, frame.shape[0], frame.shape[1])
         
         if len(face_names) == 0:
             return False, []
@@ -89,6 +317,17 @@ class CameraHandler:
         return has_unknown, face_names
  
     def cleanup(self):
-        self.picam2.stop()
+        self.running = False
+        if self.capture_thread:
+            self.capture_thread.join(timeout=2)
+        self.sfr.stop_watching()
+        if self.source:
+            self.source.stop()
+        
+        stats = self.tracker.get_stats()
+        print(f"Face recognition: {stats['recognitions_run']} run, "
+              f"{stats['recognitions_skipped']} avoided by tracking ({stats['skip_ratio']:.0%})")
+        for mode, timing in self.get_face_timings().items():
+            print(f"Face detection ({mode}): {timing['calls']} calls, {timing['mean_latency_ms']:.1f}ms avg")
         print("Camera stopped")
 
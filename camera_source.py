@@ -0,0 +1,177 @@
+import os
+import time
+import glob
+import cv2
+import numpy as np
+
+
+def copy_i420(src, dst, width, height):
+    """
+    Copy a stride-padded YUV420 buffer, shaped (height * 3/2, stride) as
+    Picamera2 maps it, into a packed (height * 3/2, width) I420 array.
+    """
+    stride = src.shape[1]
+    flat = src.reshape(-1)
+    out = dst.reshape(-1)
+    np.copyto(dst[:height], src[:height, :width])
+
+    cw, ch, cs = width // 2, height // 2, stride // 2
+    offset = height * stride
+    start = height * width
+    for _ in range(2):  # U then V
+        plane = flat[offset:offset + ch * cs].reshape(ch, cs)[:, :cw]
+        np.copyto(out[start:start + ch * cw].reshape(ch, cw), plane)
+        offset += ch * cs
+        start += ch * cw
+
+
+def lores_shape(lores_size):
+    width, height = lores_size
+    return (height * 3 // 2, width)
+
+
+class Picamera2Source:
+    """
+    Picamera2 with a main RGB888 stream for recording and face recognition,
+    plus an optional YUV420 lores stream scaled by the ISP to the detector's
+    input size.
+    """
+
+    def __init__(self, width, height, fps, lores_size=None):
+        from picamera2 import Picamera2, MappedArray
+        self.MappedArray = MappedArray
+
+        self.width = width
+        self.height = height
+        self.lores_size = lores_size
+
+        self.picam2 = Picamera2()
+        streams = {"main": {"size": (width, height), "format": "RGB888"}}
+        if lores_size:
+            streams["lores"] = {"size": lores_size, "format": "YUV420"}
+        config = self.picam2.create_video_configuration(
+            controls={"FrameRate": fps},
+            **streams
+        )
+        self.picam2.configure(config)
+
+    def start(self):
+        self.picam2.start()
+
+    def capture(self, main_out, lores_out=None):
+        """
+        Wait for the next frame and copy it into the given buffers; either may
+        be None to drop that stream. Returns the time spent copying.
+        """
+        request = self.picam2.capture_request()
+        start = time.perf_counter()
+        try:
+            if main_out is not None:
+                with self.MappedArray(request, "main") as m:
+                    np.copyto(main_out, m.array[:self.height, :self.width, :3])
+            if lores_out is not None:
+                with self.MappedArray(request, "lores") as m:
+                    copy_i420(m.array, lores_out, *self.lores_size)
+        finally:
+            request.release()
+        return time.perf_counter() - start
+
+    def stop(self):
+        self.picam2.stop()
+
+
+class StubCameraSource:
+    """
+    Hardware-free camera for development and tests.
+
+    Frames are paced at `fps` and come from a directory of images or a video
+    file when `path` is given, otherwise a block moves across a static
+    background. Main frames use the same byte order as Picamera2's RGB888
+    (BGR in memory) and lores frames are packed I420.
+    """
+
+    def __init__(self, width, height, fps, lores_size=None, path=None):
+        self.width = width
+        self.height = height
+        self.lores_size = lores_size
+        self.interval = 1.0 / fps
+
+        self.images = None
+        self.video = None
+        if path and os.path.isdir(path):
+            self.images = self._load_images(path)
+        elif path:
+            self.video = cv2.VideoCapture(path)
+            if not self.video.isOpened():
+                print(f"Warning: could not open stub video {path}, using synthetic frames")
+                self.video = None
+
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+        self.small = np.empty((lores_size[1], lores_size[0], 3), dtype=np.uint8) if lores_size else None
+        self.background = np.linspace(40, 160, width, dtype=np.uint8)[None, :, None].repeat(height, 0).repeat(3, 2)
+        self.index = 0
+        self.next_time = None
+
+    def _load_images(self, path):
+        images = []
+        for image_path in sorted(glob.glob(os.path.join(path, "*.*"))):
+            image = cv2.imread(image_path)
+            if image is not None:
+                images.append(cv2.resize(image, (self.width, self.height)))
+        if not images:
+            print(f"Warning: no images in {path}, using synthetic frames")
+            return None
+        return images
+
+    def _render(self):
+        if self.images:
+            np.copyto(self.frame, self.images[self.index % len(self.images)])
+        elif self.video is not None:
+            ok, image = self.video.read()
+            if not ok:
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, image = self.video.read()
+            if ok:
+                cv2.resize(image, (self.width, self.height), dst=self.frame)
+        else:
+            np.copyto(self.frame, self.background)
+            size = self.height // 4
+            x = (self.index * 4) % (self.width - size)
+            y = self.height // 2 - size // 2
+            self.frame[y:y + size, x:x + size] = (30, 200, 30)
+        self.index += 1
+
+    def start(self):
+        self.next_time = time.monotonic()
+
+    def capture(self, main_out, lores_out=None):
+        self.next_time += self.interval
+        delay = self.next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next_time = time.monotonic()
+
+        start = time.perf_counter()
+        self._render()
+        if main_out is not None:
+            np.copyto(main_out, self.frame)
+        if lores_out is not None:
+            cv2.resize(self.frame, self.lores_size, dst=self.small, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(self.small, cv2.COLOR_BGR2YUV_I420, dst=lores_out)
+        return time.perf_counter() - start
+
+    def stop(self):
+        if self.video is not None:
+            self.video.release()
+
+
+def create_camera_source(width, height, fps, lores_size=None):
+    kind = os.getenv('CAMERA_SOURCE', 'picamera2').lower()
+    if kind == 'stub':
+        path = os.getenv('CAMERA_STUB_PATH', '') or None
+        print(f"Using stub camera source ({path or 'synthetic'})")
+        return StubCameraSource(width, height, fps, lores_size, path)
+    if kind != 'picamera2':
+        print(f"Warning: unknown CAMERA_SOURCE '{kind}', using picamera2")
+    return Picamera2Source(width, height, fps, lores_size)
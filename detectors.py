@@ -0,0 +1,220 @@
+import os
+import sys
+import glob
+import time
+import argparse
+import importlib
+from abc import ABC, abstractmethod
+import cv2
+import numpy as np
+
+
+class PersonDetector(ABC):
+    """
+    Interface for person detectors used by CameraHandler.
+
+    detect() takes a main-stream frame (BGR in memory, as Picamera2's
+    RGB888) and, when accepts_lores is set, an I420 lores frame at
+    input_size that should be preferred. It returns the best person
+    confidence and a list of normalized (ymin, xmin, ymax, xmax) boxes.
+    Subclasses that don't implement detect() fail when constructed.
+    """
+
+    input_size = (0, 0)
+    accepts_lores = False
+
+    @abstractmethod
+    def detect(self, frame, lores=None):
+        pass
+
+
+def _tflite():
+    try:
+        from tflite_runtime import interpreter as tflite
+    except ImportError:
+        import tensorflow.lite as tflite
+        tflite.load_delegate = tflite.experimental.load_delegate
+        tflite.OpResolverType = tflite.experimental.OpResolverType
+    return tflite
+
+
+class TFLiteSSDDetector(PersonDetector):
+    """
+    SSD-style TFLite detector with the standard postprocess outputs
+    (boxes, classes, scores).
+
+    `delegate` is 'xnnpack' (the runtime's default CPU delegate), 'none' for
+    the plain builtin kernels, or a path to a delegate library. uint8 models
+    take pixels as-is; int8 and float models get pixels normalized with
+    input_mean/input_std and quantized through a 256-entry lookup table, so
+    the conversion costs one table lookup per pixel.
+    """
+
+    def __init__(self, model_path, num_threads=1, delegate='xnnpack',
+                 threshold=0.5, person_class=0, input_mean=127.5, input_std=127.5):
+        tflite = _tflite()
+        options = {'model_path': model_path, 'num_threads': num_threads}
+        if delegate == 'none':
+            options['experimental_op_resolver_type'] = \
+                tflite.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        elif delegate != 'xnnpack':
+            options['experimental_delegates'] = [tflite.load_delegate(delegate)]
+
+        self.interpreter = tflite.Interpreter(**options)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()
+
+        self.input_index = self.input_details['index']
+        self.input_dtype = self.input_details['dtype']
+        _, height, width, _ = self.input_details['shape']
+        self.input_size = (int(width), int(height))
+        self.accepts_lores = width % 2 == 0 and height % 2 == 0
+
+        self.threshold = threshold
+        self.person_class = person_class
+        self.lut = self._input_lut(input_mean, input_std)
+        self.rgb = np.empty((height, width, 3), dtype=np.uint8)
+
+        self.description = (f"{os.path.basename(model_path)} "
+                            f"({np.dtype(self.input_dtype).name}, {num_threads} threads, {delegate})")
+
+    def _input_lut(self, mean, std):
+        if self.input_dtype == np.uint8:
+            return None
+
+        values = (np.arange(256, dtype=np.float32) - mean) / std
+        if self.input_dtype == np.float32:
+            return values
+
+        scale, zero_point = self.input_details['quantization']
+        info = np.iinfo(self.input_dtype)
+        quantized = np.round(values / scale + zero_point)
+        return np.clip(quantized, info.min, info.max).astype(self.input_dtype)
+
+    def _output(self, i):
+        details = self.output_details[i]
+        value = self.interpreter.get_tensor(details['index'])[0]
+        if value.dtype != np.float32:
+            scale, zero_point = details['quantization']
+            value = (value.astype(np.float32) - zero_point) * scale
+        return value
+
+    def detect(self, frame, lores=None):
+        tensor = self.interpreter.tensor(self.input_index)
+        if lores is not None and self.accepts_lores:
+            # Picamera2's RGB888 is BGR in memory, so the main path also feeds RGB
+            rgb = tensor()[0] if self.lut is None else self.rgb
+            cv2.cvtColor(lores, cv2.COLOR_YUV2RGB_I420, dst=rgb)
+        else:
+            # Resizing first means the channel swap only touches model-sized pixels
+            frame_resized = cv2.resize(frame, self.input_size)
+            rgb = tensor()[0] if self.lut is None else self.rgb
+            cv2.cvtColor(frame_resized, cv2.COLOR_RGB2BGR, dst=rgb)
+        if self.lut is not None:
+            np.take(self.lut, self.rgb, out=tensor()[0])
+        del tensor
+
+        self.interpreter.invoke()
+
+        boxes = self._output(0)
+        classes = self._output(1)
+        scores = self._output(2)
+
+        person_confidence = 0.0
+        person_boxes = []
+        for i in range(len(scores)):
+            if int(classes[i]) == self.person_class and scores[i] > self.threshold:
+                person_boxes.append(tuple(float(v) for v in boxes[i]))
+                if scores[i] > person_confidence:
+                    person_confidence = float(scores[i])
+        return person_confidence, person_boxes
+
+
+DETECTORS = {
+    'tflite_ssd': TFLiteSSDDetector
+}
+
+
+def create_detector(**overrides):
+    """
+    Build the detector named by PERSON_DETECTOR: a key of DETECTORS or a
+    'module:ClassName' path to any PersonDetector subclass. The class is
+    called with the model_path, num_threads, delegate and threshold options.
+    """
+    name = os.getenv('PERSON_DETECTOR', 'tflite_ssd')
+    if ':' in name:
+        module_name, class_name = name.split(':', 1)
+        cls = getattr(importlib.import_module(module_name), class_name)
+    else:
+        cls = DETECTORS[name]
+    if not (isinstance(cls, type) and issubclass(cls, PersonDetector)):
+        raise TypeError(f"PERSON_DETECTOR {name} is not a PersonDetector subclass")
+
+    options = {
+        'model_path': os.getenv('DETECTOR_MODEL', 'requisites/detect.tflite'),
+        'num_threads': int(os.getenv('DETECTOR_THREADS', 1)),
+        'delegate': os.getenv('DETECTOR_DELEGATE', 'xnnpack'),
+        'threshold': float(os.getenv('DETECTOR_THRESHOLD', 0.5))
+    }
+    options.update(overrides)
+    return cls(**options)
+
+
+def load_frames(folder):
+    frames = {}
+    for label in ('person', 'empty'):
+        paths = sorted(glob.glob(os.path.join(folder, label, "*.*")))
+        frames[label] = [img for img in (cv2.imread(p) for p in paths) if img is not None]
+    return frames
+
+
+def benchmark(detector, frames, warmup=5):
+    """Latency over every frame plus recall on person/ and false positives on empty/."""
+    all_frames = frames['person'] + frames['empty']
+    for frame in all_frames[:warmup]:
+        detector.detect(frame)
+
+    latencies = []
+    hits = {'person': 0, 'empty': 0}
+    for label in ('person', 'empty'):
+        for frame in frames[label]:
+            start = time.perf_counter()
+            confidence, _ = detector.detect(frame)
+            latencies.append(time.perf_counter() - start)
+            if confidence > 0:
+                hits[label] += 1
+
+    latencies = np.array(latencies) * 1000
+    n_person, n_empty = len(frames['person']), len(frames['empty'])
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'fps': 1000.0 / float(latencies.mean()),
+        'recall': hits['person'] / n_person if n_person else 0.0,
+        'false_positive_rate': hits['empty'] / n_empty if n_empty else 0.0
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark person detectors on sample frames")
+    parser.add_argument('frames', help="folder with person/ and empty/ subfolders of images")
+    parser.add_argument('--model', default='requisites/detect.tflite')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--delegate', nargs='+', default=['xnnpack', 'none'])
+    parser.add_argument('--threshold', type=float, default=0.5)
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames)
+    if not frames['person'] and not frames['empty']:
+        sys.exit(f"No images found under {args.frames}/person or {args.frames}/empty")
+    print(f"{len(frames['person'])} person frames, {len(frames['empty'])} empty frames")
+
+    for delegate in args.delegate:
+        for threads in args.threads:
+            detector = create_detector(model_path=args.model, num_threads=threads,
+                                       delegate=delegate, threshold=args.threshold)
+            result = benchmark(detector, frames)
+            print(f"  {detector.description}: p50 {result['p50_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms, "
+                  f"{result['fps']:.1f} fps, recall {result['recall']:.2f}, "
+                  f"false positives {result['false_positive_rate']:.2f}")
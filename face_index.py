@@ -0,0 +1,99 @@
+import numpy as np
+
+
+class FaceIndex:
+    """
+    Exact nearest-neighbour search over known face encodings.
+
+    Encodings are held as one contiguous float64[N, 128] matrix with cached
+    squared norms, so all faces detected in a frame are matched with a
+    single matrix product.
+    """
+
+    def __init__(self, encodings, names):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float64).reshape(-1, 128)
+        self.names = list(names)
+        self.sq_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _distances(self, queries, rows=None):
+        encodings = self.encodings if rows is None else self.encodings[rows]
+        sq_norms = self.sq_norms if rows is None else self.sq_norms[rows]
+        q_sq = np.einsum('ij,ij->i', queries, queries)
+        d2 = q_sq[:, None] + sq_norms[None, :] - 2.0 * (queries @ encodings.T)
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2)
+
+    def search(self, queries):
+        """Return (best_index, best_distance) arrays, one entry per query."""
+        distances = self._distances(queries)
+        best = np.argmin(distances, axis=1)
+        return best, distances[np.arange(len(queries)), best]
+
+    def match(self, queries, tolerance=0.6):
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 128)
+        if len(queries) == 0:
+            return []
+        if len(self) == 0:
+            return ["Unknown"] * len(queries)
+
+        best, distances = self.search(queries)
+        return [self.names[i] if d <= tolerance else "Unknown"
+                for i, d in zip(best, distances)]
+
+
+class IVFFaceIndex(FaceIndex):
+    """
+    Approximate search for large enrolments: encodings are partitioned by a
+    small k-means quantizer and each query is compared only against the
+    members of its `n_probe` closest partitions.
+    """
+
+    def __init__(self, encodings, names, n_lists=None, n_probe=3, iterations=10):
+        super().__init__(encodings, names)
+        n = len(self.encodings)
+        self.n_lists = n_lists or max(1, int(np.sqrt(n)))
+        self.n_probe = min(n_probe, self.n_lists)
+        self.centroids, assignments = self._kmeans(iterations)
+        self.lists = [np.flatnonzero(assignments == k) for k in range(self.n_lists)]
+
+    def _kmeans(self, iterations):
+        rng = np.random.default_rng(0)
+        data = self.encodings
+        centroids = data[rng.choice(len(data), self.n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = np.argmin(self._to_centroids(data, centroids), axis=1)
+            for k in range(self.n_lists):
+                members = data[assignments == k]
+                if len(members) > 0:
+                    centroids[k] = members.mean(axis=0)
+        return centroids, np.argmin(self._to_centroids(data, centroids), axis=1)
+
+    def _to_centroids(self, queries, centroids):
+        c_sq = np.einsum('ij,ij->i', centroids, centroids)
+        q_sq = np.einsum('ij,ij->i', queries, queries)
+        return q_sq[:, None] + c_sq[None, :] - 2.0 * (queries @ centroids.T)
+
+    def search(self, queries):
+        probes = np.argsort(self._to_centroids(queries, self.centroids), axis=1)[:, :self.n_probe]
+
+        best = np.empty(len(queries), dtype=np.int64)
+        best_distances = np.empty(len(queries), dtype=np.float64)
+        for i, query in enumerate(queries):
+            rows = np.concatenate([self.lists[k] for k in probes[i]])
+            if len(rows) == 0:
+                rows = np.arange(len(self.encodings))
+            distances = self._distances(query[None, :], rows)[0]
+            j = np.argmin(distances)
+            best[i] = rows[j]
+            best_distances[i] = distances[j]
+        return best, best_distances
+
+
+def build_index(encodings, names, ann_threshold):
+    if len(names) >= ann_threshold:
+        return IVFFaceIndex(encodings, names)
+    return FaceIndex(encodings, names)
@@ -1,8 +1,31 @@
-import datetime as dt
-import math
 import numpy as np
 
+# Version 1 is the original 19-feature vector; version 2 appends the
+# spectral audio features. A model's input width identifies its version.
+FEATURE_VERSION_SIZES = {1: 19, 2: 25}
+
+SPECTRAL_FEATURES = (
+    'band_low',
+    'band_mid',
+    'band_high',
+    'band_top',
+    'spectral_centroid',
+    'spectral_flux'
+)
+
+def version_for_size(n_features):
+    for version, size in FEATURE_VERSION_SIZES.items():
+        if size == n_features:
+            return version
+    raise ValueError(f"No feature version has {n_features} features")
+
 class event:
+    version = 1
+    
+    # Time of day on the unit circle, supplied by the sleep schedule tick
+    time_sine = 0.00
+    time_cosine = 1.00
+    
     door_open = False
     window_open = False
     motion_level = 0.00
@@ -22,15 +45,17 @@ class event:
     motion_variance = 0.00
     high_motion_frames = 0
     
+    band_low = 0.00
+    band_mid = 0.00
+    band_high = 0.00
+    band_top = 0.00
+    spectral_centroid = 0.00
+    spectral_flux = 0.00
+    
     def preprocess(self):
-        time = dt.datetime.now()
-        day_frac = (time.hour * 3600 + time.minute * 60 + time.second)/86400
-        time_sine = math.sin(2 * math.pi * day_frac)
-        time_cosine = math.cos(2 * math.pi * day_frac)
-        
-        features = np.array([
-            time_sine,
-            time_cosine,
+        values = [
+            event.time_sine,
+            event.time_cosine,
             event.door_open,
             event.window_open,
             event.motion_level,
@@ -48,7 +73,12 @@ class event:
             event.mean_motion,
             event.motion_variance,
             event.high_motion_frames
-        ], dtype=np.float32)
+        ]
+        
+        if event.version >= 2:
+            values += [getattr(event, name) for name in SPECTRAL_FEATURES]
+        
+        features = np.array(values, dtype=np.float32)
         
         return features
 
@@ -0,0 +1,182 @@
+import threading
+import time
+
+
+class Stage:
+    """
+    One pipeline stage running `func` on its own thread.
+
+    Items are pulled from `source(timeout)`; the most recent result is kept
+    together with a sequence number so consumers can wait for fresh output
+    or just read whatever is latest.
+    """
+
+    def __init__(self, name, source, func):
+        self.name = name
+        self.source = source
+        self.func = func
+
+        self.result = None
+        self.seq = 0
+        self.cond = threading.Condition()
+
+        self.processed = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"stage-{self.name}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            item = self.source(0.5)
+            if item is None:
+                continue
+
+            start = time.perf_counter()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                print(f"[Pipeline] {self.name} stage error: {e}")
+                continue
+            latency = time.perf_counter() - start
+
+            with self.cond:
+                self.result = result
+                self.seq += 1
+                self.processed += 1
+                self.last_latency = latency
+                self.total_latency += latency
+                self.cond.notify_all()
+
+    def latest(self):
+        with self.cond:
+            return self.seq, self.result
+
+    def wait_newer(self, seq, timeout=None):
+        with self.cond:
+            if self.seq <= seq:
+                self.cond.wait(timeout)
+            return self.seq, self.result
+
+    def get_stats(self):
+        mean_latency = self.total_latency / self.processed if self.processed else 0.0
+        return {
+            'processed': self.processed,
+            'last_latency_ms': self.last_latency * 1000,
+            'mean_latency_ms': mean_latency * 1000
+        }
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+
+
+class FramePipeline:
+    """
+    Motion and inference as separate threads fed by the camera's frame ring.
+
+    The camera capture thread is the capture stage. Motion and inference each
+    hold their own subscription and always pick up the newest frame on the
+    detection stride, so a slow face pass only skips frames for inference
+    and never holds up capture or motion. Fusion reads the latest result of
+    each stage via latest_results().
+    """
+
+    def __init__(self, camera, detection_interval, gate=None):
+        self.camera = camera
+        self.detection_interval = detection_interval
+        self.gate = gate
+        self.record_frames = False  # set while a sensor trace is recording
+
+        self.motion_frames = camera.subscribe()
+        self.inference_frames = camera.subscribe()
+
+        self.motion = Stage("motion", self._source(self.motion_frames), self._motion)
+        self.inference = Stage("inference", self._source(self.inference_frames, gate), self._infer)
+
+    def _source(self, subscription, gate=None):
+        def next_frame(timeout):
+            ref = subscription.next(timeout)
+            if ref is None:
+                return None
+            if ref.seq % self.detection_interval != 0 or (gate and not gate.should_run(ref.seq)):
+                ref.release()
+                return None
+            return ref
+        return next_frame
+
+    def _motion(self, ref):
+        try:
+            # The ring slot is reused once released, so a traced frame is copied
+            frame = ref.array.copy() if self.record_frames else None
+            return self.camera.detect_motion(ref.array, ref.lores), frame
+        finally:
+            ref.release()
+
+    def _infer(self, ref):
+        try:
+            frame = ref.array
+            person_confidence, person_boxes = self.camera.detect_person(frame, ref.lores)
+            unknown_person = False
+            detected_names = []
+
+            if person_confidence > 0.5:
+                unknown_person, detected_names = self.camera.detect_faces(frame, person_boxes)
+        finally:
+            ref.release()
+
+        return {
+            'person_confidence': person_confidence,
+            'unknown_person': unknown_person,
+            'detected_names': detected_names
+        }
+
+    def start(self):
+        for stage in (self.motion, self.inference):
+            stage.start()
+        print(f"Frame pipeline started (detection every {self.detection_interval} frames)")
+
+    def wait_for_motion(self, seq, timeout=1.0):
+        """Return (seq, motion_level, frame); frame is None unless record_frames is set."""
+        seq, result = self.motion.wait_newer(seq, timeout)
+        if result is None:
+            return seq, 0.0, None
+        return (seq,) + result
+
+    def wake(self):
+        """Make a pending wait_for_motion() return early, e.g. on a GPIO edge."""
+        with self.motion.cond:
+            self.motion.cond.notify_all()
+
+    def latest_results(self, motion_level):
+        _, inference = self.inference.latest()
+        results = {
+            'motion_level': motion_level,
+            'person_confidence': 0.0,
+            'unknown_person': False,
+            'detected_names': []
+        }
+        if inference is not None:
+            results.update(inference)
+        return results
+
+    def get_stats(self):
+        stats = {
+            'motion': self.motion.get_stats(),
+            'inference': self.inference.get_stats()
+        }
+        stats['motion']['dropped'] = self.motion_frames.skipped
+        stats['inference']['dropped'] = self.inference_frames.skipped
+        stats['capture'] = self.camera.get_capture_stats()
+        return stats
+
+    def stop(self):
+        for stage in (self.motion, self.inference):
+            stage.stop()
@@ -1,14 +1,45 @@
-import RPi.GPIO as GPIO
 import os
+import time
+import threading
+from collections import deque
 from dotenv import load_dotenv
 
 load_dotenv()
 
+def load_gpio():
+    backend = os.getenv('GPIO_BACKEND', 'rpi').lower()
+    if backend == 'mock':
+        from mock_gpio import MockGPIO
+        print("Using mock GPIO backend")
+        return MockGPIO()
+    import RPi.GPIO as GPIO
+    return GPIO
+
 class GPIOHandler:
-    def __init__(self):
+    """
+    Door/window inputs via edge-triggered callbacks.
+
+    Callbacks run on the GPIO library's thread and push timestamped
+    transitions onto a deque (append/popleft are atomic); read_states()
+    drains it once per processed frame. A door opening while armed sounds
+    the buzzer straight from the callback and on_transition, when set, is
+    called so the main loop can wake early.
+    
+    An edge read mid-bounce can match the old state and the settling edge
+    is then swallowed by bouncetime, so read_states() also re-reads every
+    pin and synthesizes the transition the callbacks missed.
+    """
+    
+    def __init__(self, gpio=None, bouncetime=None, clock=time.monotonic):
+        self.GPIO = gpio or load_gpio()
+        GPIO = self.GPIO
+        
         self.door_pin = int(os.getenv('GPIO_DOOR_PIN', 5))
         self.window_pin = int(os.getenv('GPIO_WINDOW_PIN', 6))
         self.buzzer_pin = int(os.getenv('GPIO_BUZZER_PIN', 16))
+        self.bouncetime = int(os.getenv('GPIO_BOUNCE_MS', 50)) if bouncetime is None else bouncetime
+        self.alarm_hold = float(os.getenv('GPIO_ALARM_HOLD_SECONDS', 30))
+        self.clock = clock
         
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(self.door_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
@@ -16,46 +47,98 @@ class GPIOHandler:
         GPIO.setup(self.buzzer_pin, GPIO.OUT)
         GPIO.output(self.buzzer_pin, GPIO.LOW)
         
-        self.last_door_state = GPIO.input(self.door_pin)
-        self.last_window_state = GPIO.input(self.window_pin)
+        self.pin_names = {self.door_pin: 'door', self.window_pin: 'window'}
+        self.states = {pin: GPIO.input(pin) == GPIO.HIGH for pin in self.pin_names}
         self.buzzer_active = False
         
-        print(f"GPIO initialized: door={self.door_pin}, window={self.window_pin}, buzzer={self.buzzer_pin}")
+        self.state_lock = threading.Lock()
+        self.transitions = deque(maxlen=256)
+        self.dropped = 0
+        self.bounces = 0
+        self.armed = False
+        self.alarm_until = 0.0
+        self.on_transition = None
+        
+        # Fall back to polling if the kernel refuses edge detection
+        self.polling = False
+        try:
+            for pin in self.pin_names:
+                GPIO.add_event_detect(pin, GPIO.BOTH, callback=self._on_edge, bouncetime=self.bouncetime)
+        except RuntimeError as e:
+            print(f"[GPIO] Edge detection unavailable ({e}), polling instead")
+            self.polling = True
+        
+        print(f"GPIO initialized: door={self.door_pin}, window={self.window_pin}, buzzer={self.buzzer_pin}"
+              f"{' (polling)' if self.polling else ''}")
     
-    def read_states(self):
-        door_open = GPIO.input(self.door_pin) == GPIO.HIGH
-        window_open = GPIO.input(self.window_pin) == GPIO.HIGH
+    def _on_edge(self, pin):
+        # The callback thread and read_states() may both see the same change
+        with self.state_lock:
+            is_open = self.GPIO.input(pin) == self.GPIO.HIGH
+            if is_open == self.states[pin]:
+                self.bounces += 1
+                return
+            self.states[pin] = is_open
         
-        transitions = []
+        name = f"{self.pin_names[pin]}_{'opened' if is_open else 'closed'}"
+        if len(self.transitions) == self.transitions.maxlen:
+            self.dropped += 1
+        self.transitions.append((time.time(), name))
         
-        if door_open != self.last_door_state:
-            transitions.append(f"door_{'opened' if door_open else 'closed'}")
-            self.last_door_state = door_open
+        if name == "door_opened" and self.armed:
+            self.alarm_until = self.clock() + self.alarm_hold
+            self.activate_buzzer()
         
-        if window_open != self.last_window_state:
-            transitions.append(f"window_{'opened' if window_open else 'closed'}")
-            self.last_window_state = window_open
+        if self.on_transition:
+            self.on_transition(name)
+    
+    def _poll(self):
+        for pin in self.pin_names:
+            if (self.GPIO.input(pin) == self.GPIO.HIGH) != self.states[pin]:
+                self._on_edge(pin)
+    
+    def read_states(self):
+        # Also catches levels the edge callbacks lost to bouncetime
+        self._poll()
         
+        events = []
+        while self.transitions:
+            events.append(self.transitions.popleft())
+        transitions = [name for _, name in events]
+        
+        # A door opened and closed since the last frame still counts as open
+        return {
+            'door_open': self.states[self.door_pin] or 'door_opened' in transitions,
+            'window_open': self.states[self.window_pin] or 'window_opened' in transitions,
+            'transitions': transitions,
+            'events': events
+        }
+    
+    def alarm_active(self):
+        """True while a fast-path alarm from a door event is being held."""
+        return self.clock() < self.alarm_until
+    
+    def get_stats(self):
         return {
-            'door_open': door_open,
-            'window_open': window_open,
-            'transitions': transitions
+            'queued': len(self.transitions),
+            'dropped': self.dropped,
+            'bounces': self.bounces,
+            'polling': self.polling
         }
     
     def activate_buzzer(self):
         if not self.buzzer_active:
-            GPIO.output(self.buzzer_pin, GPIO.HIGH)
+            self.GPIO.output(self.buzzer_pin, self.GPIO.HIGH)
             self.buzzer_active = True
             print("[Buzzer] ACTIVATED")
     
     def deactivate_buzzer(self):
         if self.buzzer_active:
-            GPIO.output(self.buzzer_pin, GPIO.LOW)
+            self.GPIO.output(self.buzzer_pin, self.GPIO.LOW)
             self.buzzer_active = False
             print("[Buzzer] Deactivated")
     
     def cleanup(self):
         self.deactivate_buzzer()
-        GPIO.cleanup()
+        self.GPIO.cleanup()
         print("GPIO cleaned up")
-
@@ -0,0 +1,60 @@
+import os
+import math
+import numpy as np
+
+WEIGHTS_PATH = 'models/weights.npy'
+
+
+class NumpyModel:
+    """
+    TensorFlow-free scorer for the single Dense(n->1, sigmoid) intrusion model.
+
+    The parameters are kept as one float32 vector: the kernel followed by the
+    bias. Publishing new weights rebinds that vector, so a reader always sees
+    either the old or the new parameters, never a mix.
+    """
+
+    def __init__(self, params=None):
+        self.params = params
+
+    @classmethod
+    def from_keras(cls, model):
+        engine = cls()
+        engine.sync(model)
+        return engine
+
+    def sync(self, model):
+        kernel, bias = model.layers[-1].get_weights()
+        self.params = np.concatenate([kernel[:, 0], bias]).astype(np.float32)
+
+    def is_ready(self):
+        return self.params is not None
+
+    def predict(self, features, threshold=0.3):
+        params = self.params
+        z = float(np.dot(params[:-1], features) + params[-1])
+
+        # Numerically stable sigmoid
+        if z >= 0:
+            prob = 1.0 / (1.0 + math.exp(-z))
+        else:
+            ez = math.exp(z)
+            prob = ez / (1.0 + ez)
+
+        return {
+            'probability': prob,
+            'is_intrusion': prob >= threshold
+        }
+
+    def save(self, filename=WEIGHTS_PATH):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, self.params)
+        os.replace(tmp, filename)
+
+
+def load_weights(filename=WEIGHTS_PATH):
+    params = np.load(filename, mmap_mode='r')
+    print(f"Weights loaded from {filename}")
+    return NumpyModel(params)
@@ -1,34 +1,146 @@
-import tensorflow as tf
 import os
-from model import create_model, predict, train
-from replay import ReplayBuffer, save_buffer, load_buffer
+import time
+import threading
+from replay import ReplayBuffer, ReplayStore
+from inference import NumpyModel, WEIGHTS_PATH, load_weights
+from features import event, version_for_size, FEATURE_VERSION_SIZES
+import metrics
+
+INFERENCE_BACKENDS = ('numpy', 'keras', 'compare')
+MODEL_PATH = 'models/model.keras'
 
 class IntrusionSystem:
+    """
+    The intrusion model: scored with NumpyModel, trained with Keras.
+
+    With the numpy backend and saved weights, startup only memory-maps
+    models/weights.npy; TensorFlow and the Keras model are loaded on the
+    first training step, on the trainer thread.
+    """
+
     def __init__(self, load_existing=False):
-        model_path = 'models/model.keras'
-        buffer_path = 'replay_buffers/buffer.pkl'
-        
-        if load_existing and os.path.exists(model_path) and os.path.exists(buffer_path):
-            self.model = tf.keras.models.load_model(model_path)
-            self.buffer = load_buffer(buffer_path)
+        self.backend = os.getenv('INFERENCE_BACKEND', 'numpy').lower()
+        if self.backend not in INFERENCE_BACKENDS:
+            print(f"Unknown INFERENCE_BACKEND '{self.backend}', using numpy")
+            self.backend = 'numpy'
+
+        self.store = ReplayStore('replay_buffers')
+        self.keras = None
+        self.model = None
+        self.engine = None
+
+        existing = load_existing and os.path.exists(MODEL_PATH) and self.store.exists()
+        if existing and self.backend == 'numpy' and os.path.exists(WEIGHTS_PATH):
+            self.engine = load_weights(WEIGHTS_PATH)
+            n_features = len(self.engine.params) - 1
+            self.buffer = self._load_buffer(n_features)
+            print("Loaded existing system (Keras model deferred until training)")
+        elif existing:
+            n_features = self._load_keras().input_shape[-1]
+            self.buffer = self._load_buffer(n_features)
             print("Loaded existing system")
         else:
-            self.model = create_model()
-            self.buffer = ReplayBuffer()
+            version = int(os.getenv('FEATURE_VERSION', 1))
+            n_features = FEATURE_VERSION_SIZES[version]
+            self._import_keras()
+            self.model = self.keras.create_model(n_features=n_features)
+            self.buffer = ReplayBuffer(n_features=n_features)
+            self.store.start(self.buffer)
             print("Created new system")
-    
+
+        # Existing models keep the feature layout they were trained with
+        self.feature_version = version_for_size(n_features)
+        event.version = self.feature_version
+        print(f"Feature version: {self.feature_version} ({n_features} features)")
+
+        # Guards the Keras model, which the trainer thread updates in place
+        self.lock = threading.Lock()
+
+        # Otherwise export from the Keras model so both backends start identical
+        if self.engine is None:
+            self.engine = NumpyModel.from_keras(self.model)
+
+        self.compare_count = 0
+        self.compare_max_diff = 0.0
+        self.compare_keras_time = 0.0
+        self.compare_numpy_time = 0.0
+        print(f"Inference backend: {self.backend}")
+
+        self.detect = metrics.timed('intrusion_detect', self.detect)
+        self.train_features = metrics.timed('train', self.train_features)
+        self.save = metrics.timed('save', self.save)
+
+    def _import_keras(self):
+        if self.keras is None:
+            import model as keras_model
+            self.keras = keras_model
+        return self.keras
+
+    def _load_keras(self):
+        """The saved Keras model, loaded on first use; TensorFlow is imported here."""
+        if self.model is None:
+            self._import_keras()
+            import tensorflow as tf
+            self.model = tf.keras.models.load_model(MODEL_PATH)
+        return self.model
+
+    def _load_buffer(self, n_features):
+        buffer = self.store.load(n_features)
+        if buffer.n_features != n_features:
+            print(f"Replay buffer has {buffer.n_features} features, model expects {n_features}; starting a new buffer")
+            buffer = ReplayBuffer(n_features=n_features)
+            self.store.start(buffer)
+        return buffer
+
     def detect(self, event_instance):
         features = event_instance.preprocess()
-        result = predict(self.model, features)
-        return result
-    
+
+        if self.backend == 'keras':
+            with self.lock:
+                return self.keras.predict(self.model, features)
+        if self.backend == 'compare':
+            with self.lock:
+                return self._compare(features)
+        return self.engine.predict(features)
+
+    def _compare(self, features):
+        start = time.perf_counter()
+        keras_result = self.keras.predict(self.model, features)
+        mid = time.perf_counter()
+        numpy_result = self.engine.predict(features)
+        end = time.perf_counter()
+
+        self.compare_count += 1
+        self.compare_keras_time += mid - start
+        self.compare_numpy_time += end - mid
+        diff = abs(keras_result['probability'] - numpy_result['probability'])
+        self.compare_max_diff = max(self.compare_max_diff, diff)
+
+        if self.compare_count % 100 == 0:
+            keras_ms = self.compare_keras_time / self.compare_count * 1000
+            numpy_ms = self.compare_numpy_time / self.compare_count * 1000
+            print(f"[Inference] keras={keras_ms:.3f}ms numpy={numpy_ms:.3f}ms "
+                  f"max_diff={self.compare_max_diff:.2e} over {self.compare_count} calls")
+
+        return numpy_result
+
     def update(self, event_instance, user_label):
         features = event_instance.preprocess()
-        train(self.model, self.buffer, features, user_label)
-    
+        self.train_features(features, user_label)
+
+    def train_features(self, features, user_label):
+        with self.lock:
+            model = self._load_keras()
+            self.keras.train(model, self.buffer, features, user_label)
+            self.store.append(features, user_label)
+            self.engine.sync(model)
+
     def save(self):
         os.makedirs('models', exist_ok=True)
-        self.model.save('models/model.keras')
-        save_buffer(self.buffer, 'replay_buffers/buffer.pkl')
+        with self.lock:
+            # Without a loaded Keras model nothing was trained since startup
+            if self.model is not None:
+                self.model.save(MODEL_PATH)
+                self.engine.save(WEIGHTS_PATH)
+            self.store.maybe_compact(self.buffer)
         print("System saved")
-
@@ -2,23 +2,33 @@ import os
 import sys
 import time
 import signal
+import threading
 import numpy as np
 from datetime import datetime
 from collections import deque
 from dotenv import load_dotenv
 from intrusion_system import IntrusionSystem
-from features import event
+from trainer import Trainer
+from features import event, SPECTRAL_FEATURES
 from gpio_handler import GPIOHandler
-from audio_handler import AudioHandler
-from camera_handler import CameraHandler
-from recording_manager import RecordingManager
-from websocket_server import WebSocketServer
-from settings_manager import SettingsManager
+from telemetry import pack_telemetry
+from frame_pipeline import FramePipeline
+from scheduler import AdaptiveScheduler
+import metrics
 
 load_dotenv("dotenv")
 
 class MainSystem:
-    def __init__(self):
+    def __init__(self, **components):
+        """
+        Components can be passed by name (intrusion_system, trainer, gpio,
+        audio, camera, recorder, settings, ws) to replace the hardware and
+        service defaults, as trace_replay does. `clock` (monotonic) and
+        `wall_clock` (epoch seconds) replace the time sources for timers
+        and cooldowns. The hardware and service modules are only imported
+        for the defaults that are actually built, so replay needs none of
+        pyaudio, OpenCV, face_recognition, Redis or websockets.
+        """
         self.running = False
         self.frame_count = 0
         self.detection_interval = int(os.getenv('DETECTION_FRAME_INTERVAL', 3))
@@ -27,13 +37,61 @@ class MainSystem:
         print("Initializing Intrusion Detection System")
         print("=" * 50)
         
-        self.intrusion_system = IntrusionSystem(load_existing=True)
-        self.gpio = GPIOHandler()
-        self.audio = AudioHandler()
-        self.camera = CameraHandler()
-        self.recorder = RecordingManager(self.camera, self.camera.fps)
-        self.settings = SettingsManager()
-        self.ws = WebSocketServer(self.on_websocket_message)
+        self.clock = components.get('clock', time.monotonic)
+        self.wall_clock = components.get('wall_clock', time.time)
+        self.intrusion_system = components.get('intrusion_system') or IntrusionSystem(load_existing=True)
+        self.trainer = components.get('trainer') or Trainer(self.intrusion_system)
+        self.gpio = components.get('gpio') or GPIOHandler(clock=self.clock)
+        self.gpio_wakeup = threading.Event()
+        
+        self.audio = components.get('audio')
+        if self.audio is None:
+            from audio_handler import AudioHandler
+            self.audio = AudioHandler(spectral=event.version >= 2)
+        self.camera = components.get('camera')
+        if self.camera is None:
+            from camera_handler import CameraHandler
+            self.camera = CameraHandler()
+        self.recorder = components.get('recorder')
+        if self.recorder is None:
+            from recording_manager import RecordingManager
+            self.recorder = RecordingManager(self.camera, self.camera.fps)
+        self.settings = components.get('settings')
+        if self.settings is None:
+            from settings_manager import SettingsManager
+            self.settings = SettingsManager()
+        self.ws = components.get('ws')
+        if self.ws is None:
+            from websocket_server import WebSocketServer
+            self.ws = WebSocketServer(self.on_websocket_message)
+        self.trace = None
+        
+        # Full detection rate while anything is active, a slow stride when quiet
+        self.scheduler = AdaptiveScheduler(
+            self.detection_interval,
+            int(os.getenv('IDLE_DETECTION_INTERVAL', 30)),
+            float(os.getenv('IDLE_AFTER_SECONDS', 30)),
+            self.clock
+        )
+        self.detection_gate = self.scheduler.gate('detection')
+        self.last_stage_results = {
+            'motion_level': 0.0,
+            'person_confidence': 0.0,
+            'unknown_person': False,
+            'detected_names': []
+        }
+        self.process_frame = metrics.timed('process_frame', self.process_frame)
+        
+        self.pipeline_mode = os.getenv('PIPELINE_MODE', 'false').lower() == 'true'
+        self.pipeline = None
+        if self.pipeline_mode:
+            self.pipeline = FramePipeline(self.camera, self.detection_interval,
+                                          self.scheduler.gate('inference'))
+        self.pipeline_stats_interval = 30.0
+        self.last_pipeline_stats = 0
+        
+        # Set once the pipeline exists, since edges wake whichever loop runs
+        self.gpio.on_transition = self.on_gpio_transition
         
         self.recording_grace_timer = 0
         self.recording_active = False
@@ -42,6 +100,9 @@ class MainSystem:
         
         self.last_probability_send = 0
         self.probability_send_interval = 5.0
+        self.last_metrics_send = 0
+        self.metrics_send_interval = float(os.getenv('METRICS_INTERVAL', 10.0))
+        self.telemetry_seq = 0
         
         self.pending_feedback = {}
         self.awaiting_feedback = False
@@ -75,6 +136,7 @@ class MainSystem:
         print(f"Temporal window: {window_size}s ({self.motion_window_size} samples)")
         
         self.load_system_state()
+        self.update_armed()
         
         print("=" * 50)
         print("System initialization complete")
@@ -106,36 +168,83 @@ class MainSystem:
     
     def start(self):
         self.running = True
+        self.trainer.start()
         self.audio.start()
         self.ws.start()
         
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
         
+        if metrics.ENABLED:
+            metrics.start_http_server()
+        
+        trace_dir = os.getenv('TRACE_DIR', '')
+        if trace_dir:
+            self.start_trace(trace_dir)
+        
         print("\n" + "=" * 50)
         print("System started, entering main loop")
         print("=" * 50 + "\n")
         
-        self.main_loop()
+        if self.pipeline_mode:
+            self.pipeline.start()
+            self.pipeline_loop()
+        else:
+            self.main_loop()
+    
+    def start_trace(self, trace_dir):
+        # Everything process_frame reads, so trace_replay can re-run it off the Pi
+        from sensor_trace import TraceRecorder
+        self.trace = TraceRecorder(os.path.join(trace_dir, datetime.now().strftime('%Y%m%d_%H%M%S')), {
+            'fps': self.camera.fps,
+            'detection_interval': self.detection_interval,
+            'pipeline_mode': self.pipeline_mode,
+            'operation_mode': self.operation_mode,
+            'feature_version': event.version,
+            'audio': {'rate': self.audio.rate, 'chunk_size': self.audio.chunk_size},
+            'gpio': {'door_open': self.gpio.states[self.gpio.door_pin],
+                     'window_open': self.gpio.states[self.gpio.window_pin]},
+            'settings': self.settings.settings
+        })
+        self.audio.tap = self.trace.record_audio
+        if self.pipeline:
+            self.pipeline.record_frames = True
+    
+    def on_settings_changed(self):
+        print("[Settings] Reloaded from file")
+        self.update_armed()
+        if self.trace:
+            self.trace.record_settings(self.settings.settings)
     
     def main_loop(self):
+        frames = self.camera.subscribe()
         while self.running:
             try:
-                frame = self.camera.capture_frame()
+                ref = frames.next()
+                if ref is None:
+                    continue
                 
-                if self.frame_count % 100 == 0:
-                    if self.settings.check_for_updates():
-                        print("[Settings] Reloaded from file")
+                # Only compares snapshot versions; Redis is read on the settings thread
+                if self.settings.check_for_updates():
+                    self.on_settings_changed()
                 
-                should_detect = (self.frame_count % self.detection_interval == 0)
-                if should_detect:
-                    self.process_frame(frame)
+                try:
+                    # A door/window edge gets the very next frame, off-stride or not
+                    woken = self.gpio_wakeup.is_set()
+                    if woken:
+                        self.gpio_wakeup.clear()
+                    should_detect = woken or (self.frame_count % self.detection_interval == 0)
+                    if should_detect:
+                        if self.trace:
+                            self.trace.record_frame(self.frame_count, ref.array)
+                        self.process_frame(ref.array, lores=ref.lores)
+                finally:
+                    ref.release()
                 
                 if self.recorder.is_recording():
                     self.manage_recording()
                 
                 self.frame_count += 1
-                time.sleep(0.001)
                 
             except KeyboardInterrupt:
                 break
@@ -143,7 +252,112 @@ class MainSystem:
                 print(f"[ERROR] Main loop: {e}")
                 time.sleep(1)
     
-    def process_frame(self, frame):
+    def pipeline_loop(self):
+        # Capture, motion and inference run on their own threads; this loop
+        # fuses their latest results once per motion result, or straight
+        # away with the latest ones after a door/window edge
+        motion_seq = 0
+        while self.running:
+            try:
+                timeout = 0 if self.gpio_wakeup.is_set() else 1.0
+                seq, motion_level, frame = self.pipeline.wait_for_motion(motion_seq, timeout)
+                woken = self.gpio_wakeup.is_set()
+                if woken:
+                    self.gpio_wakeup.clear()
+                new_frame = seq != motion_seq
+                if not new_frame and not woken:
+                    continue
+                motion_seq = seq
+                
+                if self.settings.check_for_updates():
+                    self.on_settings_changed()
+                
+                if self.trace and frame is not None and new_frame:
+                    self.trace.record_frame(self.frame_count, frame, copy=False)
+                self.process_frame(None, self.pipeline.latest_results(motion_level))
+                
+                if self.recorder.is_recording():
+                    self.manage_recording()
+                
+                if new_frame:
+                    self.frame_count += self.detection_interval
+                
+                current_time = self.clock()
+                if current_time - self.last_pipeline_stats >= self.pipeline_stats_interval:
+                    self.last_pipeline_stats = current_time
+                    self.print_pipeline_stats()
+                
+            except KeyboardInterrupt:
+                break
+            except Exception as e:
+                print(f"[ERROR] Pipeline loop: {e}")
+                time.sleep(1)
+    
+    def print_pipeline_stats(self):
+        for name, stats in self.pipeline.get_stats().items():
+            print(f"[Pipeline] {name}: {stats['mean_latency_ms']:.1f}ms avg, "
+                  f"{stats['last_latency_ms']:.1f}ms last, {stats['processed']} processed, "
+                  f"{stats.get('dropped', 0)} dropped")
+        tracking = self.camera.tracker.get_stats()
+        print(f"[Pipeline] face recognition: {tracking['recognitions_run']} run, "
+              f"{tracking['recognitions_skipped']} avoided, {tracking['tracks']} tracked")
+        for mode, timing in self.camera.get_face_timings().items():
+            print(f"[Pipeline] face detection ({mode}): {timing['calls']} calls, "
+                  f"{timing['mean_latency_ms']:.1f}ms avg")
+        self.print_scheduler_stats()
+        self.print_ws_stats()
+    
+    def print_ws_stats(self):
+        for address, stats in self.ws.get_stats().items():
+            print(f"[WebSocket] {address}: queue={stats['queue_depth']}, sent={stats['sent']}, "
+                  f"batches={stats['batches']}, dropped={stats['dropped']}, stale={stats['stale_dropped']}")
+    
+    def print_scheduler_stats(self):
+        stats = self.scheduler.get_stats()
+        print(f"[Scheduler] {'idle' if stats['idle'] else 'full rate'}, "
+              f"{stats['idle_seconds']:.0f}s idle, {stats['wakeups']} wakeups")
+        for name, gate in stats['gates'].items():
+            print(f"[Scheduler] {name}: {gate['runs']} run, {gate['skips']} skipped")
+    
+    def on_gpio_transition(self, transition):
+        # Called on the GPIO callback thread
+        self.gpio_wakeup.set()
+        if self.pipeline:
+            self.pipeline.wake()
+    
+    def update_armed(self):
+        # Door events sound the buzzer from the GPIO callback while armed
+        self.gpio.armed = self.operation_mode != 'learning' and self.settings.is_away_mode()
+    
+    def activity_reasons(self, motion_level, audio_data, gpio_data):
+        reasons = []
+        if motion_level > self.motion_threshold:
+            reasons.append("motion")
+        if audio_data['noise_rms'] > self.noise_threshold:
+            reasons.append("noise")
+        reasons.extend(gpio_data['transitions'])
+        if self.person_detected:
+            reasons.append("person")
+        return reasons
+    
+    def run_detection_stages(self, frame, lores=None, motion_level=None):
+        if motion_level is None:
+            motion_level = self.camera.detect_motion(frame, lores)
+        person_confidence, person_boxes = self.camera.detect_person(frame, lores)
+        unknown_person = False
+        detected_names = []
+        
+        if person_confidence > 0.5:
+            unknown_person, detected_names = self.camera.detect_faces(frame, person_boxes)
+        
+        return {
+            'motion_level': motion_level,
+            'person_confidence': person_confidence,
+            'unknown_person': unknown_person,
+            'detected_names': detected_names
+        }
+    
+    def process_frame(self, frame, stage_results=None, lores=None):
         gpio_data = self.gpio.read_states()
         audio_data = self.audio.get_features()
         
@@ -152,11 +366,34 @@ class MainSystem:
             self.send_log(transition)
             print(f"[GPIO] {transition}")
         
-        motion_level = self.camera.detect_motion(frame)
-        person_confidence = self.camera.detect_person(frame)
+        if stage_results is None:
+            motion_level = self.camera.detect_motion(frame, lores)
+        else:
+            motion_level = stage_results['motion_level']
+        
+        if self.trace:
+            self.trace.record_gpio(gpio_data['events'])
+            self.trace.record_motion(self.frame_count, motion_level)
         
+        # Motion history has one sample per processed frame, gated or not, so
+        # the window features don't depend on the schedule
         self.motion_history.append(motion_level)
         
+        # Between idle detections the person/face results of the last one are reused
+        self.scheduler.observe(self.activity_reasons(motion_level, audio_data, gpio_data))
+        if stage_results is None:
+            if self.detection_gate.should_run(self.frame_count, force=bool(gpio_data['transitions'])):
+                stage_results = self.run_detection_stages(frame, lores, motion_level)
+                self.last_stage_results = stage_results
+                if self.trace:
+                    self.trace.record_detection(self.frame_count, stage_results)
+            else:
+                stage_results = dict(self.last_stage_results, motion_level=motion_level)
+        elif self.trace:
+            self.trace.record_detection(self.frame_count, stage_results)
+        
+        person_confidence = stage_results['person_confidence']
+        
         peak_motion = 0.0
         mean_motion = 0.0
         motion_variance = 0.0
@@ -197,7 +434,8 @@ class MainSystem:
         detected_names = []
         
         if person_confidence > 0.5:
-            unknown_person, detected_names = self.camera.detect_faces(frame)
+            unknown_person = stage_results['unknown_person']
+            detected_names = stage_results['detected_names']
             
             if len(detected_names) > 0:
                 names_str = ", ".join(detected_names)
@@ -228,8 +466,11 @@ class MainSystem:
         event.unknown_person = unknown_person
         event.noise_rms = audio_data['noise_rms']
         event.noise_zcr = audio_data['noise_zcr']
-        event.is_away = self.settings.is_away_mode()
-        event.is_asleep = self.settings.is_sleep_time()
+        schedule = self.settings.tick()
+        event.is_away = schedule.away
+        event.is_asleep = schedule.asleep
+        event.time_sine = schedule.time_sine
+        event.time_cosine = schedule.time_cosine
         
         event.peak_rms = audio_data['peak_rms']
         event.mean_rms = audio_data['mean_rms']
@@ -240,6 +481,9 @@ class MainSystem:
         event.motion_variance = motion_variance
         event.high_motion_frames = high_motion_frames
         
+        for name in SPECTRAL_FEATURES:
+            setattr(event, name, audio_data.get(name, 0.0))
+        
         e = event()
         result = self.intrusion_system.detect(e)
         probability = result['probability']
@@ -249,14 +493,28 @@ class MainSystem:
         
         if probability >= high_threshold:
             self.gpio.activate_buzzer()
-        else:
+        elif not self.gpio.alarm_active():
             self.gpio.deactivate_buzzer()
         
-        current_time = time.time()
+        current_time = self.wall_clock()
         if current_time - self.last_probability_send >= self.probability_send_interval:
             self.send_probability(probability)
             self.last_probability_send = current_time
         
+        if metrics.ENABLED and current_time - self.last_metrics_send >= self.metrics_send_interval:
+            self.send_metrics()
+            self.last_metrics_send = current_time
+        
+        # Every detection tick goes to binary telemetry subscribers
+        if self.ws.has_telemetry_subscribers():
+            self.telemetry_seq += 1
+            self.ws.send_telemetry(pack_telemetry(
+                self.telemetry_seq, current_time, probability, motion_level,
+                audio_data['noise_rms'], audio_data['noise_zcr'], person_confidence,
+                gpio_data['door_open'], gpio_data['window_open'],
+                self.gpio.buzzer_active, unknown_person
+            ))
+        
         
         self.check_recording_triggers(unknown_person, probability)
         self.check_feedback_request(probability, unknown_person)
@@ -289,39 +547,33 @@ class MainSystem:
                 self.learning_clip_timer -= (1.0 / self.camera.fps * self.detection_interval)
             
             if self.learning_clip_timer <= 0 and self.recording_active:
-                self.recorder.stop_recording()
-                self.recording_active = False
-                
-                if self.current_video:
-                    print(f"[Recording] Learning clip saved: {os.path.basename(self.current_video)}")
-                    
-                    e = event()
-                    result = self.intrusion_system.detect(e)
-                    probability = result['probability']
-                    
-                    self.request_feedback_with_video(probability, False)
-                
-                self.current_video = None
-                self.current_trigger = None
+                self.finish_recording("Learning clip saved")
         else:
             if self.recording_grace_timer > 0:
                 self.recording_grace_timer -= (1.0 / self.camera.fps * self.detection_interval)
             
             if self.recording_grace_timer <= 0 and self.recording_active:
-                self.recorder.stop_recording()
-                self.recording_active = False
-                
-                if self.current_video:
-                    print(f"[Recording] Stopped and saved: {os.path.basename(self.current_video)}")
-                    
-                    e = event()
-                    result = self.intrusion_system.detect(e)
-                    probability = result['probability']
-                    
-                    self.request_feedback_with_video(probability, False)
-                
-                self.current_video = None
-                self.current_trigger = None
+                self.finish_recording("Stopped and saved")
+    
+    def finish_recording(self, status):
+        video = self.current_video
+        on_saved = None
+        
+        if video:
+            e = event()
+            result = self.intrusion_system.detect(e)
+            probability = result['probability']
+            
+            # The clip is remuxed in the background; clients hear about it once the file exists
+            def on_saved(path):
+                print(f"[Recording] {status}: {os.path.basename(path)}")
+                self.send_video_notification(path)
+                self.request_feedback_with_video(probability, False, video)
+        
+        self.recorder.stop_recording(on_saved=on_saved)
+        self.recording_active = False
+        self.current_video = None
+        self.current_trigger = None
  
     def check_feedback_request(self, probability, unknown_person):
         if self.awaiting_feedback:
@@ -330,7 +582,7 @@ class MainSystem:
         if self.operation_mode == 'learning':
             return
         
-        current_time = time.time()
+        current_time = self.wall_clock()
         cooldown = self.cooldown_config.get(self.operation_mode, 30.0)
         
         if current_time - self.last_feedback_time < cooldown:
@@ -391,7 +643,7 @@ class MainSystem:
         self.ws.send(message)
         print(f"[Feedback] Requested: {trigger} (p={probability:.2f}) - Awaiting response...")
     
-    def request_feedback_with_video(self, probability, unknown_person):
+    def request_feedback_with_video(self, probability, unknown_person, video):
         timestamp = datetime.now().isoformat()
         trigger = "video_feedback"
         
@@ -400,7 +652,7 @@ class MainSystem:
         self.pending_feedback[timestamp] = {
             'probability': probability,
             'trigger': trigger,
-            'video': self.current_video,
+            'video': video,
             'features': current_features
         }
         
@@ -411,14 +663,14 @@ class MainSystem:
             'jsonType': 'feedback_request',
             'time': timestamp,
             'trigger': trigger,
-            'video': self.current_video or "",
+            'video': video or "",
             'training_count': self.training_count,
             'operation_mode': self.operation_mode,
             'probability': round(probability, 3)
         }
         
         self.ws.send(message)
-        print(f"[Feedback] Video feedback requested: {os.path.basename(self.current_video or 'no_video')}")
+        print(f"[Feedback] Video feedback requested: {os.path.basename(video or 'no_video')}")
     
     def on_websocket_message(self, data):
         if data.get('jsonType') == 'feedback_response':
@@ -427,8 +679,12 @@ class MainSystem:
             
             if timestamp in self.pending_feedback:
                 feedback_data = self.pending_feedback[timestamp]
-                e = event()
-                self.intrusion_system.update(e, label)
+                features = event().preprocess()
+                if not self.trainer.submit(features, label):
+                    # Dropped labels don't advance the learning phases
+                    del self.pending_feedback[timestamp]
+                    self.awaiting_feedback = False
+                    return
                 
                 self.training_count += 1
                 
@@ -446,14 +702,16 @@ class MainSystem:
                     print(f"SWITCHED TO NORMAL OPERATION MODE ({confidence_threshold} samples)")
                     print("=" * 50 + "\n")
                 
+                self.update_armed()
                 self.save_system_state()
-                self.intrusion_system.save()
                 del self.pending_feedback[timestamp]
                 
                 self.awaiting_feedback = False
                 
                 target = learning_threshold if self.operation_mode == 'learning' else confidence_threshold
-                print(f"[Feedback] Processed: label={label}, count={self.training_count}/{target}")
+                stats = self.trainer.get_stats()
+                print(f"[Feedback] Processed: label={label}, count={self.training_count}/{target} "
+                      f"(train queue={stats['queue_depth']}, last train={stats['last_latency_ms']:.1f}ms)")
     
     def send_log(self, event_type):
         message = {
@@ -471,6 +729,14 @@ class MainSystem:
         }
         self.ws.send(message)
     
+    def send_metrics(self):
+        message = {
+            'jsonType': 'metrics',
+            'time': datetime.now().isoformat(),
+            'stages': metrics.snapshot()
+        }
+        self.ws.send(message)
+    
     def send_video_notification(self, video_path):
         message = {
             'jsonType': 'video',
@@ -487,12 +753,24 @@ class MainSystem:
     def shutdown(self):
         self.running = False
         
+        if self.pipeline:
+            print("Stopping frame pipeline...")
+            self.pipeline.stop()
+        
         print("Stopping recording...")
         if self.recorder.is_recording():
             self.recorder.stop_recording()
+        self.recorder.cleanup()
+        
+        self.print_scheduler_stats()
+        self.print_ws_stats()
+        
+        if self.trace:
+            self.audio.tap = None
+            self.trace.close()
         
         print("Saving system state...")
-        self.intrusion_system.save()
+        self.trainer.stop()
         self.save_system_state()
         
         print("Cleaning up resources...")
@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+
+# Fixed bucket upper bounds in seconds, two per power of two from 50us to
+# about 52s, so every histogram has the same layout and relative error
+BUCKETS = tuple(0.00005 * 2 ** (i / 2) for i in range(41))
+
+PREFIX = 'ids_stage_latency_seconds'
+
+
+class Histogram:
+    """
+    Latency histogram over BUCKETS.
+
+    observe() is a bisect and two additions with no lock, which is only
+    safe when a single thread times the stage; a reader racing the writer
+    can at worst see a count and sum one observation apart. Stages timed
+    from several threads are created with shared=True and lock instead.
+    """
+
+    def __init__(self, name, shared=False):
+        self.name = name
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        if shared:
+            self.lock = threading.Lock()
+            self.observe = self._observe_locked
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+
+    def _observe_locked(self, seconds):
+        index = bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (max bucket: +Inf)."""
+        counts = list(self.counts)
+        rank = q * sum(counts)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), counts):
+            cumulative += count
+            if count and cumulative >= rank:
+                return bound
+        return 0.0
+
+    def snapshot(self):
+        count = sum(self.counts)
+        return {
+            'count': count,
+            'mean_ms': self.total / count * 1000 if count else 0.0,
+            'p50_ms': self.quantile(0.5) * 1000,
+            'p95_ms': self.quantile(0.95) * 1000,
+            'p99_ms': self.quantile(0.99) * 1000
+        }
+
+
+histograms = {}
+_lock = threading.Lock()
+
+
+def histogram(name, shared=False):
+    with _lock:
+        if name not in histograms:
+            histograms[name] = Histogram(name, shared)
+        return histograms[name]
+
+
+def _timed(hist, func):
+    perf_counter = time.perf_counter
+    observe = hist.observe
+
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe(perf_counter() - start)
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def timed(name, func, shared=False):
+    """
+    Return `func` timed into the `name` histogram; pass shared=True when it
+    is called from more than one thread. With METRICS_ENABLED off `func`
+    itself is returned, so instrumented call sites cost nothing.
+    """
+    if not ENABLED:
+        return func
+    return _timed(histogram(name, shared), func)
+
+
+def snapshot():
+    return {name: hist.snapshot() for name, hist in list(histograms.items())}
+
+
+def render():
+    """All histograms in the Prometheus text exposition format."""
+    lines = [f"# HELP {PREFIX} Latency of each processing stage",
+             f"# TYPE {PREFIX} histogram"]
+    for name, hist in sorted(histograms.items()):
+        counts = list(hist.counts)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, counts):
+            cumulative += count
+            lines.append(f'{PREFIX}_bucket{{stage="{name}",le="{bound:.6g}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{PREFIX}_bucket{{stage="{name}",le="+Inf"}} {cumulative}')
+        lines.append(f'{PREFIX}_sum{{stage="{name}"}} {hist.total:.9g}')
+        lines.append(f'{PREFIX}_count{{stage="{name}"}} {cumulative}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port=None, host=None):
+    port = int(os.getenv('METRICS_PORT', 9108)) if port is None else port
+    host = os.getenv('METRICS_HOST', '0.0.0.0') if host is None else host
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[Metrics] Serving http://{host}:{port}/metrics")
+    return server
+
+
+def benchmark(calls=1000000):
+    """Per-call cost of a no-op instrumented through timed(), disabled and enabled."""
+    global ENABLED
+
+    def noop(x):
+        return x
+
+    def run(func):
+        start = time.perf_counter()
+        for i in range(calls):
+            func(i)
+        return (time.perf_counter() - start) / calls * 1e9
+
+    def observe_cost(hist):
+        start = time.perf_counter()
+        for i in range(calls):
+            hist.observe(0.001)
+        return (time.perf_counter() - start) / calls * 1e9
+
+    was_enabled = ENABLED
+    try:
+        ENABLED = False
+        disabled_func = timed('benchmark_disabled', noop)
+        ENABLED = True
+        enabled_func = timed('benchmark', noop)
+        shared_func = timed('benchmark_shared', noop, shared=True)
+    finally:
+        ENABLED = was_enabled
+
+    baseline = run(noop)
+    result = {
+        'baseline_ns': baseline,
+        'disabled_overhead_ns': run(disabled_func) - baseline,
+        'enabled_overhead_ns': run(enabled_func) - baseline,
+        'shared_overhead_ns': run(shared_func) - baseline,
+        'observe_ns': observe_cost(histograms['benchmark']),
+        'shared_observe_ns': observe_cost(histograms['benchmark_shared'])
+    }
+    with _lock:
+        for name in ('benchmark', 'benchmark_shared'):
+            histograms.pop(name, None)
+    return result
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    result = benchmark(calls)
+    print(f"No-op call: {result['baseline_ns']:.0f}ns")
+    print(f"Timer overhead disabled: {result['disabled_overhead_ns']:+.0f}ns/call")
+    print(f"Timer overhead enabled: {result['enabled_overhead_ns']:+.0f}ns/call "
+          f"(histogram observe {result['observe_ns']:.0f}ns)")
+    print(f"Timer overhead enabled, shared stage: {result['shared_overhead_ns']:+.0f}ns/call "
+          f"(locked observe {result['shared_observe_ns']:.0f}ns)")
@@ -0,0 +1,83 @@
+import time
+import threading
+
+
+class MockGPIO:
+    """
+    In-memory stand-in for the parts of RPi.GPIO used by GPIOHandler.
+
+    Inputs start HIGH (pull-ups) and are driven with set_input(), which fires
+    edge callbacks synchronously with the same bouncetime filtering as the
+    real library.
+    """
+
+    BCM = 11
+    IN = 1
+    OUT = 0
+    PUD_UP = 22
+    PUD_DOWN = 21
+    HIGH = 1
+    LOW = 0
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.mode = None
+        self.levels = {}
+        self.directions = {}
+        self.detectors = {}
+        self.lock = threading.Lock()
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=None, initial=LOW):
+        self.directions[pin] = direction
+        if direction == self.IN:
+            self.levels[pin] = self.LOW if pull_up_down == self.PUD_DOWN else self.HIGH
+        else:
+            self.levels[pin] = initial
+
+    def input(self, pin):
+        return self.levels[pin]
+
+    def output(self, pin, value):
+        self.levels[pin] = self.HIGH if value else self.LOW
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.detectors[pin] = {
+            'edge': edge,
+            'callback': callback,
+            'bouncetime': (bouncetime or 0) / 1000.0,
+            'last': None
+        }
+
+    def remove_event_detect(self, pin):
+        self.detectors.pop(pin, None)
+
+    def set_input(self, pin, value):
+        """Drive an input pin as if the sensor changed, firing any edge callback."""
+        value = self.HIGH if value else self.LOW
+        with self.lock:
+            previous = self.levels.get(pin)
+            self.levels[pin] = value
+            detector = self.detectors.get(pin)
+            if detector is None or previous == value:
+                return
+            if detector['edge'] == self.RISING and value != self.HIGH:
+                return
+            if detector['edge'] == self.FALLING and value != self.LOW:
+                return
+            now = time.monotonic()
+            if detector['last'] is not None and now - detector['last'] < detector['bouncetime']:
+                return
+            detector['last'] = now
+            callback = detector['callback']
+        if callback:
+            callback(pin)
+
+    def cleanup(self):
+        self.detectors.clear()
+        self.levels.clear()
+        self.directions.clear()
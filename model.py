@@ -3,12 +3,12 @@ import tensorflow as tf
 import numpy as np
 import features
 
-def create_model(learning_rate=None):
+def create_model(learning_rate=None, n_features=19):
     if learning_rate is None:
         learning_rate = float(os.getenv('LEARNING_RATE', '0.01'))
     
     model = tf.keras.Sequential([
-        tf.keras.layers.Input(shape=(19,)),
+        tf.keras.layers.Input(shape=(n_features,)),
         tf.keras.layers.Dense(1, activation='sigmoid')
     ])
 
@@ -23,12 +23,10 @@ def create_model(learning_rate=None):
 
 
 def compute_class_weights(buffer):
-    if len(buffer.memory) < 2:
+    if len(buffer) < 2:
         return {0: 1.0, 1: 10.0}
     
-    labels = [label for _, label in buffer.memory]
-    n_intrusions = sum(labels)
-    n_normal = len(labels) - n_intrusions
+    n_normal, n_intrusions = (int(n) for n in buffer.class_counts)
     
     if n_intrusions == 0:
         return {0: 1.0, 1: 10.0}
@@ -42,11 +40,12 @@ def compute_class_weights(buffer):
 def train(model, buffer, features, label):
     buffer.add(features, label)
     
-    if len(buffer.memory) < 5:
-        print(f"Need more data: {len(buffer.memory)}/5")
+    if len(buffer) < 5:
+        print(f"Need more data: {len(buffer)}/5")
         return
     
-    X_batch, y_batch = buffer.get_random_batch(16)
+    stratified = os.getenv('REPLAY_STRATIFIED', 'false').lower() == 'true'
+    X_batch, y_batch = buffer.get_random_batch(16, stratified=stratified)
     X_batch[0] = features
     y_batch[0] = label
     
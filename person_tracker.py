@@ -0,0 +1,116 @@
+def iou(a, b):
+    """Intersection over union of two (ymin, xmin, ymax, xmax) boxes."""
+    ymin = max(a[0], b[0])
+    xmin = max(a[1], b[1])
+    ymax = min(a[2], b[2])
+    xmax = min(a[3], b[3])
+    inter = max(0.0, ymax - ymin) * max(0.0, xmax - xmin)
+    if inter == 0.0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / (area_a + area_b - inter)
+
+
+class Track:
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = box
+        self.misses = 0
+        self.names = None  # None until recognition has run for this track
+        self.recognized_at = None
+
+
+class PersonTracker:
+    """
+    IoU tracker over the person boxes from the TFLite detector.
+
+    Identities found by face recognition are attached to tracks and carried
+    forward, so recognition only needs to run when a track is new, when a
+    tracked person has not shown a face yet, or when a track is due for
+    periodic re-verification.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=5, reverify_frames=30, retry_frames=5):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.reverify_frames = reverify_frames
+        self.retry_frames = retry_frames
+
+        self.tracks = []
+        self.next_id = 1
+        self.frame_index = 0
+
+        self.recognitions_run = 0
+        self.recognitions_skipped = 0
+
+    def update(self, boxes):
+        self.frame_index += 1
+
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            for b, box in enumerate(boxes):
+                overlap = iou(track.box, box)
+                if overlap >= self.iou_threshold:
+                    pairs.append((overlap, t, b))
+
+        # Greedy assignment, best overlap first
+        matched_tracks = set()
+        matched_boxes = set()
+        for _, t, b in sorted(pairs, reverse=True):
+            if t in matched_tracks or b in matched_boxes:
+                continue
+            self.tracks[t].box = boxes[b]
+            self.tracks[t].misses = 0
+            matched_tracks.add(t)
+            matched_boxes.add(b)
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+        for b, box in enumerate(boxes):
+            if b not in matched_boxes:
+                self.tracks.append(Track(self.next_id, box))
+                self.next_id += 1
+
+    def visible(self):
+        return [track for track in self.tracks if track.misses == 0]
+
+    def needs_recognition(self):
+        for track in self.visible():
+            if track.names is None:
+                return True
+            age = self.frame_index - track.recognized_at
+            if age >= self.reverify_frames or (not track.names and age >= self.retry_frames):
+                return True
+        return False
+
+    def assign(self, face_locations, face_names, frame_height, frame_width):
+        """Attach recognised faces to the visible tracks whose box contains them."""
+        for track in self.visible():
+            ymin, xmin, ymax, xmax = track.box
+            names = []
+            for (top, right, bottom, left), name in zip(face_locations, face_names):
+                cy = (top + bottom) / 2 / frame_height
+                cx = (left + right) / 2 / frame_width
+                if ymin <= cy <= ymax and xmin <= cx <= xmax:
+                    names.append(name)
+            track.names = names
+            track.recognized_at = self.frame_index
+
+    def identities(self):
+        names = []
+        for track in self.visible():
+            names.extend(track.names or [])
+        return "Unknown" in names, names
+
+    def get_stats(self):
+        total = self.recognitions_run + self.recognitions_skipped
+        return {
+            'tracks': len(self.visible()),
+            'recognitions_run': self.recognitions_run,
+            'recognitions_skipped': self.recognitions_skipped,
+            'skip_ratio': self.recognitions_skipped / total if total else 0.0
+        }
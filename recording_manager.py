@@ -1,9 +1,238 @@
 import subprocess
-import time
 import threading
+import time
+import glob
+import re
 import os
 from datetime import datetime
 
+ENCODER_ARGS = [
+    "-c:v", "libx264",
+    "-preset", "ultrafast",
+    "-tune", "zerolatency",
+    "-crf", "28",
+    "-pix_fmt", "yuv420p"
+]
+
+
+def raw_input_args(width, height, fps):
+    return [
+        "-f", "rawvideo",
+        "-pix_fmt", "rgb24",
+        "-s", f"{width}x{height}",
+        "-r", str(fps),
+        "-i", "pipe:0"
+    ]
+
+
+def default_segment_dir():
+    # Keep rolling segments in RAM where available to spare the SD card
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm/intrusion_segments"
+    return os.path.join("videos", ".segments")
+
+
+def write_frames(proc, frames, is_running, fps):
+    """
+    Pipe frames from a camera subscription into an ffmpeg process.
+
+    Frames arrive at the camera's CAMERA_FPS; frames missed while ffmpeg was
+    busy are filled by repeating the current one so the output timeline
+    stays at a constant rate. Frames are written straight from the ring
+    buffer's memory, without a bytes copy.
+    """
+    last_seq = None
+    error_count = 0
+    max_errors = 10
+
+    while is_running():
+        ref = frames.next()
+        if ref is None:
+            continue
+        try:
+            if proc.poll() is None:
+                data = ref.array.data
+                repeats = 1 if last_seq is None else min(fps, ref.seq - last_seq)
+                for _ in range(repeats):
+                    proc.stdin.write(data)
+                last_seq = ref.seq
+                error_count = 0
+            else:
+                print(f"FFmpeg process terminated unexpectedly")
+                break
+        except (BrokenPipeError, IOError) as e:
+            error_count += 1
+            print(f"Pipe error: {e}")
+            if error_count >= max_errors:
+                print(f"Too many errors, stopping recording")
+                break
+        except Exception as e:
+            print(f"Recording loop error: {e}")
+            break
+        finally:
+            ref.release()
+
+
+class SegmentEncoder:
+    """
+    Long-lived encoder writing camera frames as one-second MPEG-TS segments
+    in `directory`.
+
+    Clips are cut from these segments, so starting or stopping a clip never
+    spawns an encoder. Segments older than `keep_seconds` are pruned unless a
+    clip holds them, which keeps memory bounded while providing pre-roll.
+    If ffmpeg exits it is respawned with backoff, numbering on from the last
+    segment so indices held by clips stay valid.
+    """
+
+    SEGMENT_PATTERN = re.compile(r"seg_(\d+)\.ts$")
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, camera, fps, width, height, keep_seconds, directory):
+        self.camera = camera
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.keep_seconds = keep_seconds
+        self.directory = directory
+        self.proc = None
+        self.thread = None
+        self.running = False
+        self.holds = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.restarts = 0
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for path in glob.glob(os.path.join(self.directory, "seg_*.ts")):
+            os.remove(path)
+
+        if not self._spawn():
+            return
+
+        self.running = True
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        print(f"Encoder started: {self.keep_seconds}s pre-roll in {self.directory}")
+
+    def _spawn(self):
+        current = self.current_index()
+        start_number = 0 if current is None else current + 1
+
+        cmd = ["ffmpeg", "-y", "-loglevel", "error"]
+        cmd += raw_input_args(self.width, self.height, self.fps)
+        cmd += ENCODER_ARGS
+        cmd += [
+            "-force_key_frames", "expr:gte(t,n_forced*1)",
+            "-f", "segment",
+            "-segment_time", "1",
+            "-segment_format", "mpegts",
+            "-reset_timestamps", "1",
+            "-segment_start_number", str(start_number),
+            os.path.join(self.directory, "seg_%06d.ts")
+        ]
+
+        try:
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+            return True
+        except Exception as e:
+            print(f"Failed to start encoder: {e}")
+            return False
+
+    def is_alive(self):
+        return self.running and self.proc is not None and self.proc.poll() is None
+
+    def _run(self):
+        frames = self.camera.subscribe()
+        pruner = threading.Thread(target=self._prune_loop, daemon=True)
+        pruner.start()
+
+        backoff = 1.0
+        while self.running:
+            started = time.monotonic()
+            write_frames(self.proc, frames, lambda: self.running, self.fps)
+            if not self.running:
+                break
+
+            # ffmpeg exited or its pipe failed; a run that lasted resets the backoff
+            self._kill()
+            if time.monotonic() - started > 60:
+                backoff = 1.0
+            print(f"Encoder stopped unexpectedly, restarting in {backoff:.0f}s")
+            while not self.stopped.wait(backoff) and not self._spawn():
+                backoff = min(backoff * 2, self.MAX_BACKOFF)
+            backoff = min(backoff * 2, self.MAX_BACKOFF)
+            self.restarts += 1
+
+    def _kill(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+
+    def _prune_loop(self):
+        while self.running:
+            time.sleep(1.0)
+            with self.lock:
+                oldest_held = min(self.holds, default=None)
+            segments = self.segments()
+            for index, path in segments[:-(self.keep_seconds + 1)]:
+                if oldest_held is not None and index >= oldest_held:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def segments(self):
+        """Return (index, path) for every segment on disk, oldest first."""
+        segments = []
+        for path in glob.glob(os.path.join(self.directory, "seg_*.ts")):
+            match = self.SEGMENT_PATTERN.search(path)
+            if match:
+                segments.append((int(match.group(1)), path))
+        return sorted(segments)
+
+    def current_index(self):
+        """Index of the segment being written, or None before the first one."""
+        segments = self.segments()
+        return segments[-1][0] if segments else None
+
+    def hold(self, index):
+        with self.lock:
+            self.holds.append(index)
+
+    def unhold(self, index):
+        with self.lock:
+            self.holds.remove(index)
+
+    def wait_complete(self, index, timeout):
+        """Wait until segment `index` is closed, i.e. a newer one exists."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            current = self.current_index()
+            if current is not None and current > index:
+                return True
+            if not self.is_alive():
+                return True
+            time.sleep(0.1)
+        return False
+
+    def stop(self):
+        self.running = False
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+        if self.proc and self.proc.poll() is None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=5)
+            except Exception:
+                self.proc.kill()
+                self.proc.wait()
+
+
 class RecordingManager:
     def __init__(self, camera, fps=30):
         self.camera = camera
@@ -11,137 +240,108 @@ class RecordingManager:
         self.width = 640
         self.height = 480
         self.recording = False
-        self.ffmpeg_proc = None
-        self.record_thread = None
-        self.stderr_thread = None
-        self.stop_event = threading.Event()
+        self.clip = None
+        self.last_clip_end = None
+        self.finalize_threads = []
         os.makedirs("videos", exist_ok=True)
 
-    def _read_stderr(self):
-        if self.ffmpeg_proc and self.ffmpeg_proc.stderr:
-            for line in iter(self.ffmpeg_proc.stderr.readline, b''):
-                if line:
-                    print(f"[FFMPEG] {line.decode('utf-8', errors='ignore').strip()}")
+        self.preroll_seconds = int(os.getenv('RECORDING_PREROLL_SECONDS', 5))
+        self.segment_dir = os.getenv('RECORDING_SEGMENT_DIR', default_segment_dir())
+
+        self.encoder = SegmentEncoder(camera, fps, self.width, self.height,
+                                      self.preroll_seconds, self.segment_dir)
+        self.encoder.start()
 
     def start_recording(self, trigger):
         if self.recording:
             return None
-        
-        timestamp = datetime.now().strftime("%H%M%S_%d%m%y")
-        filename = f"{timestamp}_{trigger}.mp4"
-        output_path = os.path.join("videos", filename)
-        
-        cmd = [
-            "ffmpeg", "-y",
-            "-f", "rawvideo",
-            "-pix_fmt", "rgb24",
-            "-s", f"{self.width}x{self.height}",
-            "-r", str(self.fps),
-            "-i", "pipe:0",
-            "-c:v", "libx264",
-            "-preset", "ultrafast",
-            "-tune", "zerolatency",
-            "-crf", "28",
-            "-movflags", "+faststart",
-            "-pix_fmt", "yuv420p",
-            output_path
-        ]
 
-        try:
-            self.ffmpeg_proc = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                bufsize=10**8
-            )
-            
-            self.stderr_thread = threading.Thread(
-                target=self._read_stderr,
-                daemon=True
-            )
-            self.stderr_thread.start()
-            
-            self.recording = True
-            self.stop_event.clear()
-            self.record_thread = threading.Thread(
-                target=self._recording_loop,
-                args=(filename,),
-                daemon=True
-            )
-            self.record_thread.start()
-            print(f"Recording started: {filename}")
-            return filename
-        except Exception as e:
-            print(f"Failed to start recording: {e}")
+        current = self.encoder.current_index()
+        if not self.encoder.is_alive() or current is None:
+            print("Failed to start recording: encoder not running")
             return None
 
-    def _recording_loop(self, filename):
-        frame_interval = 1.0 / self.fps
-        error_count = 0
-        max_errors = 10
-        
-        while self.recording and not self.stop_event.is_set():
-            try:
-                start = time.time()
-                frame = self.camera.capture_frame()
-                
-                if self.ffmpeg_proc and self.ffmpeg_proc.poll() is None:
-                    self.ffmpeg_proc.stdin.write(frame.tobytes())
-                    error_count = 0
-                else:
-                    print(f"FFmpeg process terminated unexpectedly")
-                    break
-                
-                elapsed = time.time() - start
-                sleep_time = max(0, frame_interval - elapsed)
-                time.sleep(sleep_time)
-            except (BrokenPipeError, IOError) as e:
-                error_count += 1
-                print(f"Pipe error: {e}")
-                if error_count >= max_errors:
-                    print(f"Too many errors, stopping recording")
-                    break
-            except Exception as e:
-                print(f"Recording loop error: {e}")
-                break
+        timestamp = datetime.now().strftime("%H%M%S_%d%m%y")
+        filename = f"{timestamp}_{trigger}.mp4"
+
+        # Segments are one second long, so N seconds of pre-roll are the N
+        # segments before the one currently being written. A clip that
+        # follows straight on from the previous one starts after it instead
+        first = max(0, current - self.preroll_seconds)
+        if self.last_clip_end is not None:
+            first = max(first, self.last_clip_end + 1)
+        self.encoder.hold(first)
+        self.clip = {
+            'filename': filename,
+            'output_path': os.path.join("videos", filename),
+            'first': first
+        }
+        self.recording = True
+        print(f"Recording started: {filename} ({max(0, current - first)}s pre-roll)")
+        return filename
 
-    def stop_recording(self):
+    def stop_recording(self, on_saved=None):
+        """
+        Stop the clip and remux its segments on a background thread.
+        `on_saved(output_path)` is called from that thread once the file
+        exists; it is not called if saving fails.
+        """
         if not self.recording:
             return
-        
+
         print("Stopping recording gracefully")
         self.recording = False
-        self.stop_event.set()
-        
-        if self.record_thread and self.record_thread.is_alive():
-            self.record_thread.join(timeout=2)
-        
-        if self.ffmpeg_proc and self.ffmpeg_proc.poll() is None:
+        clip = self.clip
+        clip['last'] = self.encoder.current_index()
+        self.last_clip_end = clip['last']
+        self.clip = None
+
+        thread = threading.Thread(target=self._finalize, args=(clip, on_saved), daemon=True)
+        thread.start()
+        self.finalize_threads = [t for t in self.finalize_threads if t.is_alive()] + [thread]
+
+    def _finalize(self, clip, on_saved):
+        try:
+            if not self.encoder.wait_complete(clip['last'], timeout=5):
+                print(f"Segment {clip['last']} not closed in time, clip may be short")
+
+            parts = [path for index, path in self.encoder.segments()
+                     if clip['first'] <= index <= clip['last']]
+            if not parts:
+                print(f"No segments for {clip['filename']}")
+                return
+
+            list_path = os.path.join(self.segment_dir, f"{clip['filename']}.txt")
+            with open(list_path, 'w') as f:
+                for part in parts:
+                    f.write(f"file '{os.path.abspath(part)}'\n")
+
+            cmd = [
+                "ffmpeg", "-y", "-loglevel", "error",
+                "-f", "concat", "-safe", "0",
+                "-i", list_path,
+                "-c", "copy",
+                "-movflags", "+faststart",
+                clip['output_path']
+            ]
             try:
-                self.ffmpeg_proc.stdin.close()
-                print("Waiting for ffmpeg to finalize")
-                try:
-                    stdout, stderr = self.ffmpeg_proc.communicate(timeout=10)
-                    if stdout:
-                        print(f"[FFMPEG stdout] {stdout.decode('utf-8', errors='ignore')}")
-                    if stderr:
-                        print(f"[FFMPEG stderr] {stderr.decode('utf-8', errors='ignore')}")
-                except subprocess.TimeoutExpired:
-                    print("FFmpeg timeout, forcing termination")
-                    self.ffmpeg_proc.kill()
-                    self.ffmpeg_proc.wait()
+                subprocess.run(cmd, check=True, timeout=30)
             except Exception as e:
-                print(f"Error during ffmpeg shutdown: {e}")
-                try:
-                    self.ffmpeg_proc.kill()
-                    self.ffmpeg_proc.wait()
-                except:
-                    pass
-        
-        self.ffmpeg_proc = None
-        print("Recording stopped and saved")
+                print(f"Failed to save recording {clip['filename']}: {e}")
+                return
+            finally:
+                os.remove(list_path)
+
+            print(f"Recording stopped and saved: {clip['filename']} ({len(parts)} segments)")
+            if on_saved:
+                on_saved(clip['output_path'])
+        finally:
+            self.encoder.unhold(clip['first'])
 
     def is_recording(self):
         return self.recording
 
+    def cleanup(self):
+        for thread in self.finalize_threads:
+            thread.join(timeout=10)
+        self.encoder.stop()
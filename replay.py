@@ -1,46 +1,257 @@
 import os
-import time
+import re
+import glob
 import pickle
-import shutil
-import numpy as np 
+import numpy as np
+
+N_FEATURES = 19
 
 class ReplayBuffer:
-    def __init__(self):
-        self.memory = [] 
-        self.max_size = 500
-    
+    """
+    Fixed-size circular buffer of labeled feature vectors.
+
+    Storage is preallocated, so adding a sample is O(1) and evicts the oldest
+    one in place. Per-class counts are kept up to date on every add so class
+    weights never need a rescan.
+    """
+
+    def __init__(self, max_size=500, n_features=N_FEATURES):
+        self.max_size = max_size
+        self.n_features = n_features
+        self.features = np.zeros((max_size, n_features), dtype=np.float32)
+        self.labels = np.zeros(max_size, dtype=np.uint8)
+        self.class_counts = np.zeros(2, dtype=np.int64)
+        self.head = 0
+        self.size = 0
+        self.rng = np.random.default_rng()
+
+    def __len__(self):
+        return self.size
+
     def add(self, features, label):
-        self.memory.append((features, label))
-        if len(self.memory) > self.max_size:
-            self.memory.pop(0)
-    
-    def get_random_batch(self, size=16):
-        import random 
-        if len(self.memory) < size:
-            batch = self.memory
+        label = int(label)
+        if self.size == self.max_size:
+            self.class_counts[self.labels[self.head]] -= 1
+        else:
+            self.size += 1
+
+        self.features[self.head] = features
+        self.labels[self.head] = label
+        self.class_counts[label] += 1
+        self.head = (self.head + 1) % self.max_size
+
+    def get_random_batch(self, size=16, stratified=False):
+        if stratified:
+            idx = self._stratified_indices(size)
+        elif self.size <= size:
+            idx = np.arange(self.size)
         else:
-            batch = random.sample(self.memory, size)
-        
-        X = np.array([item[0] for item in batch])
-        y = np.array([item[1] for item in batch])
-        
-        return X, y
-
-def save_buffer(buffer, filename='replay_buffers/buffer.pkl'):
+            idx = self.rng.choice(self.size, size, replace=False)
+
+        return self.features[idx], self.labels[idx].astype(np.float32)
+
+    def _stratified_indices(self, size):
+        valid = self.labels[:self.size]
+        normal = np.flatnonzero(valid == 0)
+        intrusion = np.flatnonzero(valid == 1)
+
+        # Half the batch from each class; a short class hands its share to the other
+        n_intrusion = min(len(intrusion), size // 2)
+        n_normal = min(len(normal), size - n_intrusion)
+        n_intrusion = min(len(intrusion), size - n_normal)
+
+        return np.concatenate([
+            self.rng.choice(normal, n_normal, replace=False),
+            self.rng.choice(intrusion, n_intrusion, replace=False)
+        ])
+
+    def ordered(self):
+        """Return (features, labels) oldest first."""
+        if self.size < self.max_size:
+            return self.features[:self.size], self.labels[:self.size]
+        order = np.roll(np.arange(self.max_size), -self.head)
+        return self.features[order], self.labels[order]
+
+def save_buffer(buffer, filename='replay_buffers/buffer.npy'):
+    """
+    Write the buffer as a single (n, n_features + 1) float32 .npy array,
+    oldest row first, with the label in the last column.
+    """
     os.makedirs(os.path.dirname(filename), exist_ok=True)
-    if os.path.isfile(filename):
-        ts = time.strftime("%Y%m%d_%H%M%S")
-        backup = os.path.join(os.path.dirname(filename), f"replay_buffer_{ts}.pkl")
-        shutil.move(filename, backup)
-    with open(filename, 'wb') as f:
-        pickle.dump(buffer.memory, f)
+    features, labels = buffer.ordered()
+    rows = np.empty((len(labels), buffer.n_features + 1), dtype=np.float32)
+    rows[:, :-1] = features
+    rows[:, -1] = labels
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, rows)
+    os.replace(tmp, filename)
     print(f"Buffer saved to {filename}")
 
-def load_buffer(filename='replay_buffers/buffer.pkl'):
-    buffer = ReplayBuffer()
-    with open(filename, 'rb') as f:
-        buffer.memory = pickle.load(f)
+def load_buffer(filename='replay_buffers/buffer.npy'):
+    if filename.endswith('.pkl'):
+        return _load_pickled_buffer(filename)
+
+    rows = np.load(filename, mmap_mode='r')
+    buffer = ReplayBuffer(n_features=rows.shape[1] - 1)
+    fill_buffer(buffer, rows)
     print(f"Buffer loaded from {filename}")
     return buffer
 
+def fill_buffer(buffer, rows):
+    """Replace the buffer contents with `rows` (oldest first)."""
+    rows = rows[-buffer.max_size:]
+    n = len(rows)
+    buffer.features[:n] = rows[:, :-1]
+    buffer.labels[:n] = rows[:, -1]
+    buffer.class_counts[:] = np.bincount(buffer.labels[:n], minlength=2)[:2]
+    buffer.size = n
+    buffer.head = n % buffer.max_size
+
+def _load_pickled_buffer(filename):
+    # Buffers written before the ring buffer were a pickled list of (features, label)
+    with open(filename, 'rb') as f:
+        memory = pickle.load(f)
+    buffer = ReplayBuffer()
+    for features, label in memory[-buffer.max_size:]:
+        buffer.add(features, label)
+    print(f"Legacy buffer loaded from {filename}")
+    return buffer
+
+class ReplayStore:
+    """
+    Append-only persistence for a ReplayBuffer.
+
+    Each labeled sample is appended to a journal as one (n_features + 1)
+    float32 row, the same layout as a snapshot row. Every `compact_every`
+    samples the whole buffer is written to a new snapshot generation and a
+    fresh journal is started. Recovery loads the newest snapshot and replays
+    the journal of that generation on top of it.
+
+    Files: snapshot_<gen>.npy and journal_<gen>.log in `directory`.
+    """
+
+    def __init__(self, directory='replay_buffers'):
+        self.directory = directory
+        self.compact_every = int(os.getenv('REPLAY_COMPACT_EVERY', 100))
+        self.retention = max(1, int(os.getenv('REPLAY_SNAPSHOT_RETENTION', 3)))
+        self.generation = 0
+        self.journal = None
+        self.pending = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _snapshot_path(self, generation):
+        return os.path.join(self.directory, f"snapshot_{generation:06d}.npy")
+
+    def _journal_path(self, generation):
+        return os.path.join(self.directory, f"journal_{generation:06d}.log")
+
+    def _generations(self, prefix):
+        pattern = re.compile(rf"{prefix}_(\d{{6}})\.")
+        generations = []
+        for path in glob.glob(os.path.join(self.directory, f"{prefix}_*")):
+            match = pattern.match(os.path.basename(path))
+            if match:
+                generations.append(int(match.group(1)))
+        return sorted(generations)
+
+    def _legacy_path(self):
+        for name in ('buffer.npy', 'buffer.pkl'):
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def exists(self):
+        return bool(self._generations('snapshot') or self._generations('journal')
+                    or self._legacy_path())
+
+    def load(self, n_features=N_FEATURES):
+        snapshots = self._generations('snapshot')
+        journals = self._generations('journal')
+
+        if snapshots:
+            self.generation = snapshots[-1]
+            buffer = load_buffer(self._snapshot_path(self.generation))
+        elif journals:
+            self.generation = journals[-1]
+            buffer = ReplayBuffer(n_features=n_features)
+        else:
+            legacy = self._legacy_path()
+            buffer = load_buffer(legacy) if legacy else ReplayBuffer(n_features=n_features)
+            self.compact(buffer)
+            return buffer
+
+        replayed = self._replay_journal(buffer)
+        self._open_journal()
+        self.pending = replayed
+        print(f"Replay store recovered generation {self.generation} (+{replayed} journaled samples)")
+        return buffer
+
+    def _replay_journal(self, buffer):
+        path = self._journal_path(self.generation)
+        if not os.path.exists(path):
+            return 0
+
+        width = buffer.n_features + 1
+        record_size = width * 4
+        valid_size = os.path.getsize(path) // record_size * record_size
+        if valid_size != os.path.getsize(path):
+            # Drop a record torn by a crash mid-write so new appends stay aligned
+            print(f"Truncating partial record in {path}")
+            os.truncate(path, valid_size)
+
+        rows = np.fromfile(path, dtype=np.float32).reshape(-1, width)
+        for row in rows:
+            buffer.add(row[:-1], row[-1])
+        return len(rows)
+
+    def _open_journal(self):
+        if self.journal:
+            self.journal.close()
+        self.journal = open(self._journal_path(self.generation), 'ab')
+
+    def start(self, buffer):
+        """Begin a new generation holding exactly `buffer`."""
+        self.generation = max(self._generations('snapshot') + self._generations('journal') + [0])
+        self.compact(buffer)
+
+    def append(self, features, label):
+        row = np.empty(len(features) + 1, dtype=np.float32)
+        row[:-1] = features
+        row[-1] = label
+        self.journal.write(row.tobytes())
+        self.journal.flush()
+        self.pending += 1
+
+    def maybe_compact(self, buffer):
+        if self.pending >= self.compact_every:
+            self.compact(buffer)
+
+    def compact(self, buffer):
+        generation = self.generation + 1
+        save_buffer(buffer, self._snapshot_path(generation))
+
+        self.generation = generation
+        self._open_journal()
+        self.pending = 0
+        self._apply_retention()
+
+    def _apply_retention(self):
+        for generation in self._generations('journal'):
+            if generation < self.generation:
+                os.remove(self._journal_path(generation))
+
+        for generation in self._generations('snapshot')[:-self.retention]:
+            os.remove(self._snapshot_path(generation))
+
+        # Timestamped pickles left behind by the old save-with-backup scheme
+        backups = sorted(glob.glob(os.path.join(self.directory, 'replay_buffer_*.pkl')))
+        for path in backups[:-self.retention]:
+            os.remove(path)
 
+    def close(self):
+        if self.journal:
+            self.journal.close()
+            self.journal = None
@@ -0,0 +1,80 @@
+import time
+
+
+class Gate:
+    """Per-consumer stride over frame sequence numbers, following the scheduler's rate."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.last_seq = None
+        self.runs = 0
+        self.skips = 0
+
+    def should_run(self, seq, force=False):
+        if force or self.last_seq is None or seq - self.last_seq >= self.scheduler.interval():
+            self.last_seq = seq
+            self.runs += 1
+            return True
+        self.skips += 1
+        return False
+
+
+class AdaptiveScheduler:
+    """
+    Decides how often the expensive detection stages run.
+
+    Cheap signals (motion on the downscaled frame, audio levels, GPIO
+    transitions) are observed on every detection stride. Person detection,
+    face recognition and the intrusion model run every `active_interval`
+    frames while anything is happening and drop to every `idle_interval`
+    frames once everything has been quiet for `idle_after` seconds. Any
+    activity switches back to full rate before the current frame's gate is
+    checked, so real events are handled without added latency.
+    """
+
+    def __init__(self, active_interval, idle_interval, idle_after, clock=time.monotonic):
+        self.active_interval = active_interval
+        self.idle_interval = max(active_interval, idle_interval)
+        self.idle_after = idle_after
+        self.clock = clock
+
+        self.idle = False
+        self.last_activity = clock()
+        self.idle_since = None
+        self.idle_seconds = 0.0
+        self.wakeups = 0
+        self.gates = {}
+
+    def gate(self, name):
+        self.gates[name] = Gate(self)
+        return self.gates[name]
+
+    def interval(self):
+        return self.idle_interval if self.idle else self.active_interval
+
+    def observe(self, reasons):
+        """Record the active signals seen on this frame (an empty list when quiet)."""
+        now = self.clock()
+        if reasons:
+            self.last_activity = now
+            if self.idle:
+                self.idle = False
+                self.wakeups += 1
+                self.idle_seconds += now - self.idle_since
+                print(f"[Scheduler] Full rate ({', '.join(reasons)})")
+        elif not self.idle and now - self.last_activity >= self.idle_after:
+            self.idle = True
+            self.idle_since = now
+            print(f"[Scheduler] Idle, detecting every {self.idle_interval} frames")
+
+    def get_stats(self):
+        idle_seconds = self.idle_seconds
+        if self.idle:
+            idle_seconds += self.clock() - self.idle_since
+        return {
+            'idle': self.idle,
+            'wakeups': self.wakeups,
+            'idle_seconds': idle_seconds,
+            'gates': {name: {'runs': gate.runs, 'skips': gate.skips}
+                      for name, gate in self.gates.items()}
+        }
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import queue
+import threading
+import numpy as np
+
+TRACE_VERSION = 1
+
+
+class TraceRecorder:
+    """
+    Records what MainSystem sees so it can be replayed off-device.
+
+    A trace is a directory with meta.json, events.jsonl (one JSON event per
+    line, in order, each with `t` seconds since the start), audio.pcm (the
+    raw int16 chunks that audio events point into) and frames/ (JPEGs of
+    the frames that were processed). Hot-path calls only enqueue; encoding
+    and disk writes happen on a writer thread, and events are dropped and
+    counted if it falls behind.
+    """
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "frames"), exist_ok=True)
+
+        self.start = time.monotonic()
+        meta = dict(meta, version=TRACE_VERSION, start_wall=time.time())
+        with open(os.path.join(directory, "meta.json"), 'w') as f:
+            json.dump(meta, f, indent=2, default=dict)
+
+        self.events = open(os.path.join(directory, "events.jsonl"), 'w')
+        self.audio = open(os.path.join(directory, "audio.pcm"), 'wb')
+        self.queue = queue.Queue(maxsize=int(os.getenv('TRACE_QUEUE_SIZE', 256)))
+        self.recorded = 0
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        print(f"[Trace] Recording to {directory}")
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _now(self):
+        return time.monotonic() - self.start
+
+    def record_frame(self, seq, frame, copy=True):
+        # Ring slots are reused, so frames are copied unless the caller already owns one
+        self._put(('frame', self._now(), seq, np.copy(frame) if copy else frame))
+
+    def record_audio(self, data):
+        self._put(('audio', self._now(), data))
+
+    def record_gpio(self, events):
+        for wall, name in events:
+            self._put(('event', {'t': self._now(), 'type': 'gpio', 'event': name, 'wall': wall}))
+
+    def record_settings(self, settings):
+        self._put(('event', {'t': self._now(), 'type': 'settings', 'settings': settings}))
+
+    def record_motion(self, seq, motion_level):
+        self._put(('event', {'t': self._now(), 'type': 'motion', 'seq': seq, 'motion_level': motion_level}))
+
+    def record_detection(self, seq, results):
+        self._put(('event', {'t': self._now(), 'type': 'detection', 'seq': seq,
+                             'person_confidence': float(results['person_confidence']),
+                             'unknown_person': bool(results['unknown_person']),
+                             'detected_names': list(results['detected_names'])}))
+
+    def _run(self):
+        # Only the recorder needs OpenCV; read_trace() works without it
+        import cv2
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            kind = item[0]
+            if kind == 'frame':
+                _, t, seq, frame = item
+                name = os.path.join("frames", f"{seq:08d}.jpg")
+                cv2.imwrite(os.path.join(self.directory, name), frame)
+                record = {'t': t, 'type': 'frame', 'seq': seq, 'file': name}
+            elif kind == 'audio':
+                _, t, data = item
+                record = {'t': t, 'type': 'audio', 'offset': self.audio.tell(), 'size': len(data)}
+                self.audio.write(data)
+            else:
+                record = item[1]
+            self.events.write(json.dumps(record, default=dict) + "\n")
+            self.recorded += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(timeout=10)
+        self.events.close()
+        self.audio.close()
+        print(f"[Trace] {self.recorded} events recorded, {self.dropped} dropped")
+
+
+def read_trace(directory):
+    """Return (meta, events); audio events carry their PCM bytes under 'data'."""
+    with open(os.path.join(directory, "meta.json"), 'r') as f:
+        meta = json.load(f)
+    if meta.get('version') != TRACE_VERSION:
+        raise ValueError(f"Unsupported trace version {meta.get('version')}")
+
+    with open(os.path.join(directory, "audio.pcm"), 'rb') as f:
+        audio = f.read()
+
+    events = []
+    with open(os.path.join(directory, "events.jsonl"), 'r') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                break  # torn last line from an unclean stop
+            if event['type'] == 'audio':
+                event['data'] = audio[event['offset']:event['offset'] + event['size']]
+            events.append(event)
+    return meta, events
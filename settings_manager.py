@@ -1,33 +1,139 @@
 import redis
 import json
 import os
-from datetime import datetime, time as dt_time
+import time
+import threading
 from dotenv import load_dotenv
+from settings_snapshot import build_snapshot
 
 load_dotenv("dotenv")
 
+SETTINGS_CHANNEL = 'settings_updated'
+SETTINGS_FLAG_KEY = 'file_changed'
+
 class SettingsManager:
+    """
+    User settings from user_data.json, reloaded by a background thread.
+    
+    The backend publishes on SETTINGS_CHANNEL after saving the file; a
+    keyspace notification on SETTINGS_FLAG_KEY covers backends that only
+    set the flag. Keyspace notifications are a server-wide Redis setting, so
+    they are only switched on here with SETTINGS_KEYSPACE_EVENTS=true;
+    otherwise enable them as a deployment step if needed. The flag is
+    cleared whenever it is consumed. Each reload builds a new immutable SettingsSnapshot and
+    swaps it in with one assignment, so readers on the main loop never
+    touch Redis and never see a half-applied update.
+    """
+    
     def __init__(self):
         redis_host = os.getenv('REDIS_HOST', 'localhost')
         redis_port = int(os.getenv('REDIS_PORT', 6379))
         
         self.redis_client = redis.Redis(host=redis_host, port=redis_port, 
-                                       db=0, decode_responses=True)
+                                       db=0, decode_responses=True,
+                                       socket_connect_timeout=2, health_check_interval=30)
         self.settings_file = 'user_data.json'
-        self.settings = None
+        self.keyspace_events = os.getenv('SETTINGS_KEYSPACE_EVENTS', 'false').lower() == 'true'
+        self.snapshot = None
+        self.version = 0
+        self.seen_version = 0
         
         self.load_settings()
+        self.seen_version = self.version
         print("Settings loaded from user_data.json")
+        
+        self.running = True
+        self.pubsub = None
+        self.listen_thread = threading.Thread(target=self._listen_loop, daemon=True)
+        self.listen_thread.start()
+    
+    @property
+    def settings(self):
+        return self.snapshot.settings
     
     def load_settings(self):
+        settings = None
+        for attempt in range(3):
+            try:
+                with open(self.settings_file, 'r') as f:
+                    settings = json.load(f)
+                break
+            except FileNotFoundError:
+                if self.snapshot is None:
+                    print(f"Warning: {self.settings_file} not found, using defaults")
+                    settings = self._get_default_settings()
+                break
+            except ValueError as e:
+                # The backend may still be writing the file
+                print(f"[Settings] Could not parse {self.settings_file}: {e}")
+                time.sleep(0.05)
+        
+        if settings is None:
+            return False
+        
+        self.version += 1
+        self.snapshot = build_snapshot(settings, self.version)
+        return True
+    
+    def _enable_keyspace_events(self):
         try:
-            with open(self.settings_file, 'r') as f:
-                self.settings = json.load(f)
-            
-            self.redis_client.set('is_data_updated', 'false')
-        except FileNotFoundError:
-            print(f"Warning: {self.settings_file} not found, using defaults")
-            self.settings = self._get_default_settings()
+            flags = self.redis_client.config_get('notify-keyspace-events').get('notify-keyspace-events', '')
+            wanted = flags
+            if 'K' not in wanted:
+                wanted += 'K'
+            if '$' not in wanted and 'A' not in wanted:
+                wanted += '$'
+            if wanted != flags:
+                self.redis_client.config_set('notify-keyspace-events', wanted)
+        except redis.RedisError as e:
+            print(f"[Settings] Keyspace notifications unavailable ({e}), using pub/sub only")
+    
+    def _consume_flag(self):
+        """Read and clear SETTINGS_FLAG_KEY in one step; True if a change was pending."""
+        return self.redis_client.getset(SETTINGS_FLAG_KEY, 'false') == 'true'
+    
+    def _listen_loop(self):
+        backoff = 1.0
+        reconnect = False
+        while self.running:
+            try:
+                if self.keyspace_events:
+                    self._enable_keyspace_events()
+                self.pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                self.pubsub.subscribe(SETTINGS_CHANNEL)
+                self.pubsub.psubscribe(f"__keyspace@*__:{SETTINGS_FLAG_KEY}")
+                backoff = 1.0
+                
+                # Catch changes made while we were not subscribed
+                if reconnect and self._consume_flag():
+                    self.load_settings()
+                reconnect = True
+                
+                while self.running:
+                    message = self.pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    if message['type'] == 'pmessage':
+                        # Our own clear also fires a 'set' event; only a raised flag counts
+                        if message['data'] != 'set' or not self._consume_flag():
+                            continue
+                    else:
+                        self._consume_flag()
+                    if self.load_settings():
+                        print(f"[Settings] Update received via {message['channel']}")
+            except redis.RedisError as e:
+                if not self.running:
+                    break
+                print(f"[Settings] Redis unavailable ({e}), retrying in {backoff:.0f}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if self.pubsub is not None:
+                    try:
+                        self.pubsub.close()
+                    except redis.RedisError:
+                        pass
+                    self.pubsub = None
     
     def _get_default_settings(self):
         return {
@@ -44,49 +150,30 @@ class SettingsManager:
         }
     
     def check_for_updates(self):
-        try:
-            updated = self.redis_client.get('is_data_updated')
-            if updated == 'true':
-                self.load_settings()
-                return True
-        except Exception as e:
-            print(f"Redis check error: {e}")
+        """Non-blocking: True once for each snapshot swapped in since the last call."""
+        version = self.snapshot.version
+        if version != self.seen_version:
+            self.seen_version = version
+            return True
         return False
     
     def get_thresholds(self):
-        return self.settings.get('thresholdLevels', {
-            'low': 0.3,
-            'medium': 0.5,
-            'high': 0.7
-        })
+        return self.snapshot.thresholds
     
     def is_away_mode(self):
-        return self.settings.get('vacationMode', False)
+        return self.snapshot.away
+    
+    def tick(self):
+        """Current sleep/away/time-of-day state; call once per processed frame."""
+        return self.snapshot.schedule.tick()
     
     def is_sleep_time(self):
-        now = datetime.now()
-        schedule = self.settings.get('sleepSchedule', {})
-        
-        is_weekend = now.weekday() >= 5
-        period = 'weekends' if is_weekend else 'weekdays'
-        
-        times = schedule.get(period, {})
-        start_str = times.get('start', '22:00')
-        end_str = times.get('end', '06:00')
-        
-        try:
-            start = datetime.strptime(start_str, '%H:%M').time()
-            end = datetime.strptime(end_str, '%H:%M').time()
-            current = now.time()
-            
-            if start < end:
-                return start <= current <= end
-            else:
-                return current >= start or current <= end
-        except:
-            return False
+        """Whether it is sleep time right now; tick() is the cached per-frame path."""
+        return self.snapshot.schedule.is_asleep()
     
     def cleanup(self):
+        self.running = False
+        self.listen_thread.join(timeout=2)
         self.redis_client.close()
         print("Redis connection closed")
 
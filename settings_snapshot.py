@@ -0,0 +1,26 @@
+from types import MappingProxyType
+from collections import namedtuple
+from sleep_schedule import SleepSchedule
+
+SettingsSnapshot = namedtuple('SettingsSnapshot', ['version', 'settings', 'thresholds', 'away', 'schedule'])
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def build_snapshot(settings, version):
+    return SettingsSnapshot(
+        version=version,
+        settings=_freeze(settings),
+        thresholds=_freeze(settings.get('thresholdLevels', {
+            'low': 0.3,
+            'medium': 0.5,
+            'high': 0.7
+        })),
+        away=bool(settings.get('vacationMode', False)),
+        schedule=SleepSchedule(settings.get('sleepSchedule', {}),
+                               settings.get('vacationMode', False))
+    )
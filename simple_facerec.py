@@ -2,42 +2,191 @@ import face_recognition
 import cv2
 import os
 import glob
+import json
+import hashlib
+import threading
+import time
 import numpy as np
+from face_index import FaceIndex, build_index
 
 class SimpleFacerec:
     def __init__(self):
-        self.known_face_encodings = []
-        self.known_face_names = []
+        self.index = FaceIndex([], [])  # replaced as one object on reload
         self.frame_resizing = 0.25  # resize factor for faster processing
+        self.tolerance = float(os.getenv('FACE_MATCH_TOLERANCE', 0.6))
+        self.ann_threshold = int(os.getenv('FACE_ANN_THRESHOLD', 200))
+        self.images_path = None
+        self.cache_entries = {}
+        self.watch_thread = None
+        self.watching = False
+
+    @property
+    def known_face_encodings(self):
+        return self.index.encodings
+
+    @property
+    def known_face_names(self):
+        return self.index.names
+
+    def _cache_paths(self, images_path):
+        return (os.path.join(images_path, ".encodings.npy"),
+                os.path.join(images_path, ".encodings.json"))
+
+    def _load_cache(self, images_path):
+        """
+        Read the encoding cache: a float64[N, 128] array plus a JSON sidecar
+        with one entry per row (path, mtime, size, sha1, name).
+        """
+        array_path, index_path = self._cache_paths(images_path)
+        if not (os.path.exists(array_path) and os.path.exists(index_path)):
+            return {}
+        try:
+            encodings = np.load(array_path)
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[Warning] Ignoring unreadable encoding cache: {e}")
+            return {}
+
+        entries = {}
+        for row, entry in enumerate(index):
+            entry['encoding'] = encodings[row] if entry.get('has_face') else None
+            entries[entry['path']] = entry
+        return entries
+
+    def _save_cache(self, images_path, entries):
+        array_path, index_path = self._cache_paths(images_path)
+        index = []
+        rows = []
+        for path in sorted(entries):
+            entry = entries[path]
+            record = {k: v for k, v in entry.items() if k != 'encoding'}
+            index.append(record)
+            rows.append(entry['encoding'] if entry['has_face'] else np.zeros(128))
+
+        encodings = np.array(rows, dtype=np.float64).reshape(-1, 128)
+        try:
+            with open(array_path + ".tmp", 'wb') as f:
+                np.save(f, encodings)
+            with open(index_path + ".tmp", 'w') as f:
+                json.dump(index, f)
+            os.replace(array_path + ".tmp", array_path)
+            os.replace(index_path + ".tmp", index_path)
+        except OSError as e:
+            print(f"[Warning] Could not write encoding cache: {e}")
+
+    def _file_hash(self, path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def _encode_image(self, img_path):
+        img = cv2.imread(img_path)
+        if img is None:
+            print(f"[Warning] Could not read image: {img_path}")
+            return None
+
+        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        img_encoding = face_recognition.face_encodings(rgb_img)
+
+        if len(img_encoding) == 0:
+            print(f"[Warning] No face found in image: {os.path.basename(img_path)}")
+            return None
+        return img_encoding[0]
 
     def load_encoding_images(self, images_path):
         """
-        Load encoding images from directory
+        Load encoding images from directory, re-encoding only images that
+        are new or changed since the cached encodings were written
         """
         print("Loading known faces...")
+        self.images_path = images_path
+        if not self.cache_entries:
+            self.cache_entries = self._load_cache(images_path)
+
+        entries = {}
+        encoded = 0
+        touched = 0
+        image_paths = [p for p in glob.glob(os.path.join(images_path, "*.*"))
+                       if not os.path.basename(p).startswith(".")]
+        for img_path in sorted(image_paths):
+            stat = os.stat(img_path)
+            cached = self.cache_entries.get(img_path)
+
+            # Same mtime and size is trusted; otherwise the content hash decides
+            if cached and cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+                entries[img_path] = cached
+                continue
 
-        images_path = glob.glob(os.path.join(images_path, "*.*"))
-        for img_path in images_path:
-            img = cv2.imread(img_path)
-            if img is None:
-                print(f"[Warning] Could not read image: {img_path}")
+            sha1 = self._file_hash(img_path)
+            if cached and cached['sha1'] == sha1:
+                cached.update(mtime=stat.st_mtime, size=stat.st_size)
+                entries[img_path] = cached
+                touched += 1
                 continue
 
-            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            filename = os.path.splitext(os.path.basename(img_path))[0]
+            encoding = self._encode_image(img_path)
+            encoded += 1
+            entries[img_path] = {
+                'path': img_path,
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'sha1': sha1,
+                'name': filename,
+                'has_face': encoding is not None,
+                'encoding': encoding
+            }
+            if encoding is not None:
+                print(f"Loaded encoding for {filename}")
 
-            basename = os.path.basename(img_path)
-            (filename, ext) = os.path.splitext(basename)
-            img_encoding = face_recognition.face_encodings(rgb_img)
+        changed = encoded > 0 or set(entries) != set(self.cache_entries)
+        self.cache_entries = entries
+        if changed or touched:
+            self._save_cache(images_path, entries)
 
-            if len(img_encoding) == 0:
-                print(f"[Warning] No face found in image: {filename}")
-                continue
+        encodings = [e['encoding'] for e in entries.values() if e['has_face']]
+        names = [e['name'] for e in entries.values() if e['has_face']]
+        self.index = build_index(encodings, names, self.ann_threshold)
+
+        print(f"Encoding images loaded ({len(names)} faces, {encoded} re-encoded, "
+              f"{type(self.index).__name__}).")
+        return changed
+
+    def start_watching(self, interval=5.0):
+        """Poll the images directory and hot-reload faces when it changes."""
+        self.watching = True
+        self.watch_thread = threading.Thread(target=self._watch_loop, args=(interval,), daemon=True)
+        self.watch_thread.start()
+
+    def _watch_loop(self, interval):
+        last_listing = self._listing()
+        while self.watching:
+            time.sleep(interval)
+            listing = self._listing()
+            if listing != last_listing:
+                last_listing = listing
+                try:
+                    self.load_encoding_images(self.images_path)
+                except Exception as e:
+                    print(f"[Warning] Face reload failed: {e}")
 
-            self.known_face_encodings.append(img_encoding[0])
-            self.known_face_names.append(filename)
-            print(f"Loaded encoding for {filename}")
+    def _listing(self):
+        listing = {}
+        for path in glob.glob(os.path.join(self.images_path, "*.*")):
+            if os.path.basename(path).startswith("."):
+                continue
+            try:
+                stat = os.stat(path)
+                listing[path] = (stat.st_mtime, stat.st_size)
+            except FileNotFoundError:
+                pass
+        return listing
 
-        print("Encoding images loaded.")
+    def stop_watching(self):
+        self.watching = False
 
     def detect_known_faces(self, frame):
         """
@@ -48,6 +197,8 @@ class SimpleFacerec:
             print("[Warning] Empty frame received — skipping this frame.")
             return [], []
 
+        index = self.index
+
         # Resize frame for faster processing
         small_frame = cv2.resize(frame, (0, 0),
                                  fx=self.frame_resizing,
@@ -60,19 +211,8 @@ class SimpleFacerec:
         face_locations = face_recognition.face_locations(rgb_small_frame)
         face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
 
-        face_names = []
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding)
-            name = "Unknown"
-
-            # Compute distances to known faces
-            face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-            best_match_index = np.argmin(face_distances)
-
-            if len(matches) > 0 and matches[best_match_index]:
-                name = self.known_face_names[best_match_index]
-
-            face_names.append(name)
+        # One batched distance pass for every face in the frame
+        face_names = index.match(face_encodings, self.tolerance)
 
         # Scale face locations back to original frame size
         face_locations = np.array(face_locations)
@@ -80,3 +220,44 @@ class SimpleFacerec:
 
         return face_locations.astype(int), face_names
 
+    def detect_known_faces_in_regions(self, frame, regions, scale=0.5):
+        """
+        Detect and recognize faces only inside (top, left, bottom, right)
+        pixel regions, each searched at `scale` of full resolution
+        """
+        if frame is None or frame.size == 0:
+            print("[Warning] Empty frame received — skipping this frame.")
+            return [], []
+
+        index = self.index
+        face_locations = []
+        face_encodings = []
+
+        for top, left, bottom, right in regions:
+            crop = frame[top:bottom, left:right]
+            if crop.size == 0:
+                continue
+
+            small_crop = cv2.resize(crop, (0, 0), fx=scale, fy=scale)
+            rgb_small_crop = cv2.cvtColor(small_crop, cv2.COLOR_BGR2RGB)
+
+            locations = face_recognition.face_locations(rgb_small_crop)
+            if not locations:
+                continue
+            encodings = face_recognition.face_encodings(rgb_small_crop, locations)
+
+            for (t, r, b, l), encoding in zip(locations, encodings):
+                location = (int(t / scale) + top, int(r / scale) + left,
+                            int(b / scale) + top, int(l / scale) + left)
+
+                # Overlapping person boxes can contain the same face twice
+                cy = (location[0] + location[2]) / 2
+                cx = (location[1] + location[3]) / 2
+                if any(ft <= cy <= fb and fl <= cx <= fr for ft, fr, fb, fl in face_locations):
+                    continue
+
+                face_locations.append(location)
+                face_encodings.append(encoding)
+
+        face_names = index.match(face_encodings, self.tolerance)
+        return np.array(face_locations, dtype=int).reshape(-1, 4), face_names
@@ -0,0 +1,151 @@
+import math
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+DAY_NAMES = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+DEFAULT_WINDOW = {'start': '22:00', 'end': '06:00'}
+
+ScheduleState = namedtuple('ScheduleState', ['asleep', 'away', 'time_sine', 'time_cosine'])
+
+def parse_hhmm(value):
+    hours, minutes = value.split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"time out of range: {value}")
+    return hours, minutes
+
+class SleepSchedule:
+    """
+    Sleep windows and away mode compiled into transition instants.
+
+    `sleep_schedule` is the sleepSchedule setting: 'weekdays' and 'weekends'
+    each hold a {start, end} window or a list of them, and 'overrides' maps
+    day names ('monday'...) to windows that replace the default for that
+    day. A window belongs to the day it starts on; an end at or before the
+    start runs into the next day.
+
+    Every window from yesterday to `horizon_days` ahead is resolved to
+    epoch seconds once. tick() reads the monotonic clock once, derives wall
+    time from the anchor taken at compile time, and advances cursors over
+    the transitions and local midnights, so each frame costs a few
+    comparisons. The wall clock is re-checked every `resync_seconds` and
+    the schedule recompiled if it jumped (e.g. NTP after boot).
+    """
+
+    def __init__(self, sleep_schedule, away=False, horizon_days=7, resync_seconds=60.0):
+        self.sleep_schedule = sleep_schedule or {}
+        self.away = bool(away)
+        self.horizon_days = horizon_days
+        self.resync_seconds = resync_seconds
+        self.windows = [self._day_windows(day) for day in range(7)]
+        self.compile()
+
+    def _day_windows(self, weekday):
+        overrides = self.sleep_schedule.get('overrides', {})
+        spec = overrides.get(DAY_NAMES[weekday])
+        if spec is None:
+            spec = self.sleep_schedule.get('weekends' if weekday >= 5 else 'weekdays', DEFAULT_WINDOW)
+
+        windows = []
+        for window in (spec if isinstance(spec, (list, tuple)) else [spec]):
+            try:
+                start = parse_hhmm(window.get('start', DEFAULT_WINDOW['start']))
+                end = parse_hhmm(window.get('end', DEFAULT_WINDOW['end']))
+            except (AttributeError, ValueError) as e:
+                print(f"[Schedule] Ignoring invalid sleep window {window!r} for {DAY_NAMES[weekday]}: {e}")
+                continue
+            windows.append((start, end))
+        return windows
+
+    def compile(self, now=None):
+        self.anchor_wall = time.time() if now is None else now
+        self.anchor_mono = time.monotonic()
+        self.last_resync = self.anchor_mono
+
+        today = datetime.fromtimestamp(self.anchor_wall).date()
+        days = [today + timedelta(days=offset) for offset in range(-1, self.horizon_days + 1)]
+        self.midnights = [self._instant(day, (0, 0)) for day in days]
+
+        intervals = []
+        for day in days[:-1]:
+            for start, end in self.windows[day.weekday()]:
+                end_day = day if end > start else day + timedelta(days=1)
+                intervals.append((self._instant(day, start), self._instant(end_day, end)))
+        intervals.sort()
+
+        # Merge overlaps so the flat list alternates start, end, start, end...
+        self.transitions = []
+        for start, end in intervals:
+            if self.transitions and start <= self.transitions[-1]:
+                self.transitions[-1] = max(self.transitions[-1], end)
+            else:
+                self.transitions.extend((start, end))
+
+        self.horizon = self.midnights[-2]
+        self.cursor = bisect_right(self.transitions, self.anchor_wall)
+        self.day_cursor = bisect_right(self.midnights, self.anchor_wall) - 1
+        self.state = self._evaluate(self.anchor_wall)
+
+    def _instant(self, day, hhmm):
+        return datetime(day.year, day.month, day.day, hhmm[0], hhmm[1]).timestamp()
+
+    def _evaluate(self, now):
+        while self.cursor < len(self.transitions) and self.transitions[self.cursor] <= now:
+            self.cursor += 1
+        while self.day_cursor + 1 < len(self.midnights) and self.midnights[self.day_cursor + 1] <= now:
+            self.day_cursor += 1
+
+        day_frac = (now - self.midnights[self.day_cursor]) / 86400
+        return ScheduleState(
+            asleep=self.cursor % 2 == 1,
+            away=self.away,
+            time_sine=math.sin(2 * math.pi * day_frac),
+            time_cosine=math.cos(2 * math.pi * day_frac)
+        )
+
+    def tick(self, now=None):
+        """
+        Advance to the current time, or to `now` in epoch seconds when
+        replaying a recording, and return the ScheduleState.
+        """
+        if now is None:
+            mono = time.monotonic()
+            now = self.anchor_wall + (mono - self.anchor_mono)
+
+            if mono - self.last_resync >= self.resync_seconds:
+                self.last_resync = mono
+                if abs(time.time() - now) > 1.0:
+                    print("[Schedule] Wall clock changed, recompiling")
+                    self.compile()
+                    return self.state
+        elif now < self.midnights[self.day_cursor]:
+            self.compile(now)
+            return self.state
+
+        if now >= self.horizon:
+            self.compile(now)
+            return self.state
+
+        self.state = self._evaluate(now)
+        return self.state
+
+    def is_asleep(self, now=None):
+        """
+        Whether `now` (epoch seconds, default the wall clock) is inside a
+        sleep window, evaluated on demand without moving the tick() cursors.
+        """
+        now = time.time() if now is None else now
+        transitions = self.transitions
+        if self.midnights[0] <= now < self.horizon:
+            return bisect_right(transitions, now) % 2 == 1
+        schedule = SleepSchedule(self.sleep_schedule, self.away, self.horizon_days)
+        schedule.compile(now)
+        return schedule.state.asleep
+
+    def next_transition(self):
+        """Epoch seconds of the next sleep start or end, or None beyond the horizon."""
+        if self.cursor < len(self.transitions):
+            return self.transitions[self.cursor]
+        return None
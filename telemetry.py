@@ -0,0 +1,28 @@
+import struct
+
+# One telemetry record per detection tick, little-endian, 36 bytes.
+# A binary frame carries one or more records back to back.
+TELEMETRY_VERSION = 1
+TELEMETRY = struct.Struct('<BBHIdfffff')
+TELEMETRY_FIELDS = ['version', 'flags', 'reserved', 'seq', 'time',
+                    'probability', 'motion_level', 'noise_rms', 'noise_zcr', 'person_confidence']
+TELEMETRY_FLAGS = {'door_open': 1, 'window_open': 2, 'buzzer_active': 4, 'unknown_person': 8}
+
+def pack_telemetry(seq, timestamp, probability, motion_level, noise_rms, noise_zcr,
+                   person_confidence, door_open, window_open, buzzer_active, unknown_person):
+    flags = ((TELEMETRY_FLAGS['door_open'] if door_open else 0) |
+             (TELEMETRY_FLAGS['window_open'] if window_open else 0) |
+             (TELEMETRY_FLAGS['buzzer_active'] if buzzer_active else 0) |
+             (TELEMETRY_FLAGS['unknown_person'] if unknown_person else 0))
+    return TELEMETRY.pack(TELEMETRY_VERSION, flags, 0, seq & 0xFFFFFFFF, timestamp,
+                          probability, motion_level, noise_rms, noise_zcr, person_confidence)
+
+def telemetry_schema():
+    return {
+        'jsonType': 'telemetry_schema',
+        'version': TELEMETRY_VERSION,
+        'format': TELEMETRY.format,
+        'record_size': TELEMETRY.size,
+        'fields': TELEMETRY_FIELDS,
+        'flags': TELEMETRY_FLAGS
+    }
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip('dotenv')
+
+from gpio_handler import GPIOHandler
+from mock_gpio import MockGPIO
+
+
+def make_handler():
+    return GPIOHandler(gpio=MockGPIO(), bouncetime=50, clock=lambda: 0.0)
+
+
+def test_settling_edge_swallowed_by_bouncetime():
+    gpio = make_handler()
+    door = gpio.door_pin
+    assert gpio.read_states()['door_open']
+
+    # Contact bounces closed and settles open inside the bounce window
+    gpio.GPIO.set_input(door, 0)
+    gpio.GPIO.set_input(door, 1)
+    assert gpio.GPIO.input(door) == gpio.GPIO.HIGH
+
+    first = gpio.read_states()
+    assert first['door_open']
+    assert first['transitions'] == ['door_closed', 'door_opened']
+
+    second = gpio.read_states()
+    assert second['door_open']
+    assert second['transitions'] == []
+
+
+def test_missed_opening_sounds_armed_alarm():
+    gpio = make_handler()
+    door = gpio.door_pin
+    gpio.GPIO.set_input(door, 0)
+    gpio.read_states()
+
+    seen = []
+    gpio.on_transition = seen.append
+    gpio.armed = True
+
+    # The opening edge lands in the bounce window of the closing one
+    gpio.GPIO.set_input(door, 1)
+    assert not gpio.buzzer_active
+
+    assert gpio.read_states()['door_open']
+    assert gpio.buzzer_active
+    assert seen == ['door_opened']
@@ -0,0 +1,421 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from collections import Counter
+
+from main_system import MainSystem
+from gpio_handler import GPIOHandler
+from features import event, FEATURE_VERSION_SIZES
+from mock_gpio import MockGPIO
+from audio_features import AudioFeatureExtractor
+from settings_snapshot import build_snapshot
+from inference import NumpyModel, load_weights, WEIGHTS_PATH
+from sensor_trace import read_trace
+
+
+class TraceClock:
+    """Trace time, passed to MainSystem so cooldowns and idle timers follow the recording."""
+
+    def __init__(self, start_wall):
+        self.start_wall = start_wall
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.start_wall + self.now
+
+
+class ReplayCamera:
+    """Returns the motion and detection results recorded on the device."""
+
+    def __init__(self, fps, events):
+        self.fps = fps
+        self.motion = {e['seq']: e['motion_level'] for e in events if e['type'] == 'motion'}
+        self.detections = {e['seq']: e for e in events if e['type'] == 'detection'}
+        self.seq = 0
+
+    def results(self, seq):
+        detection = self.detections.get(seq, {})
+        return {
+            'motion_level': self.motion.get(seq, 0.0),
+            'person_confidence': detection.get('person_confidence', 0.0),
+            'unknown_person': detection.get('unknown_person', False),
+            'detected_names': detection.get('detected_names', [])
+        }
+
+    def detect_motion(self, frame, lores=None):
+        return self.motion.get(self.seq, 0.0)
+
+    def detect_person(self, frame, lores=None):
+        detection = self.detections.get(self.seq)
+        return (detection['person_confidence'] if detection else 0.0), []
+
+    def detect_faces(self, frame, person_boxes=None):
+        detection = self.detections.get(self.seq)
+        if detection is None:
+            return False, []
+        return detection['unknown_person'], detection['detected_names']
+
+    def cleanup(self):
+        pass
+
+
+class ReplayAudio:
+    """Feeds recorded PCM chunks through the real feature extractor."""
+
+    def __init__(self, rate, chunk_size, spectral=False):
+        self.rate = rate
+        self.chunk_size = chunk_size
+        window_size = float(os.getenv('TEMPORAL_WINDOW_SIZE', 1.0))
+        self.extractor = AudioFeatureExtractor(chunk_size, int(window_size * rate / chunk_size),
+                                               rate, spectral=spectral)
+        self.tap = None
+
+    def feed(self, data):
+        self.extractor.process(data)
+
+    def get_features(self):
+        return dict(self.extractor.snapshot)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class ReplayGPIO(GPIOHandler):
+    """GPIOHandler on MockGPIO, with recorded transitions driven onto the pins."""
+
+    def __init__(self, door_open, window_open, clock):
+        super().__init__(gpio=MockGPIO(), bouncetime=0, clock=clock.monotonic)
+        for pin, is_open in ((self.door_pin, door_open), (self.window_pin, window_open)):
+            self.GPIO.levels[pin] = self.GPIO.HIGH if is_open else self.GPIO.LOW
+            self.states[pin] = is_open
+
+    def apply(self, transition):
+        name, state = transition.rsplit('_', 1)
+        pin = self.door_pin if name == 'door' else self.window_pin
+        self.GPIO.set_input(pin, state == 'opened')
+
+
+class ReplaySettings:
+    def __init__(self, settings, clock):
+        self.clock = clock
+        self.version = 0
+        self.seen_version = 0
+        self.update(settings)
+
+    @property
+    def settings(self):
+        return self.snapshot.settings
+
+    def update(self, settings):
+        self.version += 1
+        self.snapshot = build_snapshot(settings, self.version)
+
+    def check_for_updates(self):
+        if self.snapshot.version != self.seen_version:
+            self.seen_version = self.snapshot.version
+            return True
+        return False
+
+    def get_thresholds(self):
+        return self.snapshot.thresholds
+
+    def is_away_mode(self):
+        return self.snapshot.away
+
+    def tick(self):
+        return self.snapshot.schedule.tick(self.clock.time())
+
+    def is_sleep_time(self):
+        return self.snapshot.schedule.is_asleep(self.clock.time())
+
+    def cleanup(self):
+        pass
+
+
+class ReplayIntrusionSystem:
+    """The numpy scorer on models/weights.npy (zero weights if there is none), no TensorFlow."""
+
+    def __init__(self, feature_version):
+        event.version = feature_version
+        if os.path.exists(WEIGHTS_PATH):
+            self.engine = load_weights(WEIGHTS_PATH)
+        else:
+            print("[Replay] No saved weights, scoring with zero weights")
+            self.engine = NumpyModel(np.zeros(FEATURE_VERSION_SIZES[feature_version] + 1, dtype=np.float32))
+        self.last_probability = 0.0
+
+    def detect(self, event_instance):
+        result = self.engine.predict(event_instance.preprocess())
+        self.last_probability = result['probability']
+        return result
+
+    def save(self):
+        pass
+
+
+class ReplayTrainer:
+    def __init__(self):
+        self.submitted = 0
+
+    def start(self):
+        pass
+
+    def submit(self, features, label):
+        self.submitted += 1
+        return True
+
+    def get_stats(self):
+        return {'queue_depth': 0, 'last_latency_ms': 0.0}
+
+    def stop(self):
+        pass
+
+
+class ReplayRecorder:
+    def __init__(self):
+        self.recording = False
+        self.started = Counter()
+
+    def is_recording(self):
+        return self.recording
+
+    def start_recording(self, trigger):
+        self.recording = True
+        self.started[trigger] += 1
+        return f"replay_{sum(self.started.values()):04d}_{trigger}.mp4"
+
+    def stop_recording(self, on_saved=None):
+        self.recording = False
+        if on_saved:
+            on_saved(os.path.join("videos", "replay.mp4"))
+
+    def cleanup(self):
+        pass
+
+
+class ReplayWebSocket:
+    def __init__(self):
+        self.messages = Counter()
+        self.logs = Counter()
+
+    def send(self, data):
+        self.messages[data.get('jsonType')] += 1
+        if data.get('jsonType') == 'log':
+            self.logs[data['event'].split(':')[0]] += 1
+
+    def has_telemetry_subscribers(self):
+        return False
+
+    def get_stats(self):
+        return {}
+
+    def stop(self):
+        pass
+
+
+def timed(func, samples):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    return wrapper
+
+
+def summarize(samples):
+    if not samples:
+        return {'calls': 0}
+    ms = np.array(samples) * 1000
+    return {
+        'calls': len(samples),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max())
+    }
+
+
+def replay(trace_dir, live=False, operation_mode=None, decisions_path=None):
+    """
+    Run a trace through MainSystem.process_frame as fast as possible.
+
+    With live=True the recorded frames go through the real motion, person
+    and face stages (decoding time is left out of frames/sec); otherwise the
+    recorded stage results are used and only the fusion, model and decision
+    logic runs. Returns a report with per-stage latency percentiles,
+    frames/sec and the decisions taken.
+    """
+    meta, events = read_trace(trace_dir)
+    clock = TraceClock(meta['start_wall'])
+
+    recorded = ReplayCamera(meta['fps'], events)
+    frame_files = {}
+    camera = recorded
+    if live:
+        from cv2 import imread
+        from camera_handler import CameraHandler
+        camera = CameraHandler(capture=False)
+        camera.fps = meta['fps']
+        frame_files = {e['seq']: os.path.join(trace_dir, e['file']) for e in events if e['type'] == 'frame'}
+        missing = sum(1 for e in events if e['type'] == 'motion' and e['seq'] not in frame_files)
+        if missing:
+            print(f"[Replay] {missing} processed frames have no recorded image, using recorded results")
+
+    gpio = ReplayGPIO(meta['gpio']['door_open'], meta['gpio']['window_open'], clock)
+    audio = ReplayAudio(meta['audio']['rate'], meta['audio']['chunk_size'],
+                        spectral=meta['feature_version'] >= 2)
+    settings = ReplaySettings(meta['settings'], clock)
+    ws = ReplayWebSocket()
+    recorder = ReplayRecorder()
+
+    intrusion_system = ReplayIntrusionSystem(meta['feature_version'])
+    # Cooldowns, alarm holds and timers read the trace clock, not the wall clock
+    system = MainSystem(
+        intrusion_system=intrusion_system,
+        trainer=ReplayTrainer(),
+        gpio=gpio,
+        audio=audio,
+        camera=camera,
+        recorder=recorder,
+        settings=settings,
+        ws=ws,
+        clock=clock.monotonic,
+        wall_clock=clock.time
+    )
+    system.operation_mode = operation_mode or meta['operation_mode']
+    system.update_armed()
+
+    samples = {name: [] for name in ('process_frame', 'detect_motion', 'detect_person',
+                                     'detect_faces', 'intrusion_detect', 'audio')}
+    system.camera.detect_motion = timed(system.camera.detect_motion, samples['detect_motion'])
+    system.camera.detect_person = timed(system.camera.detect_person, samples['detect_person'])
+    system.camera.detect_faces = timed(system.camera.detect_faces, samples['detect_faces'])
+    system.intrusion_system.detect = timed(system.intrusion_system.detect, samples['intrusion_detect'])
+    feed_audio = timed(audio.feed, samples['audio'])
+    process_frame = timed(system.process_frame, samples['process_frame'])
+
+    decisions = open(decisions_path, 'w') if decisions_path else None
+    buzzer_activations = 0
+    buzzer_on = gpio.buzzer_active
+    decode_time = 0.0
+    last_seq = 0
+    start = time.perf_counter()
+
+    for e in events:
+        clock.now = e['t']
+        kind = e['type']
+        if kind == 'audio':
+            feed_audio(e['data'])
+        elif kind == 'gpio':
+            gpio.apply(e['event'])
+        elif kind == 'settings':
+            settings.update(e['settings'])
+            if settings.check_for_updates():
+                system.on_settings_changed()
+        elif kind == 'motion':
+            seq = e['seq']
+            recorded.seq = seq
+            system.frame_count = seq
+            if not live:
+                process_frame(None)
+            elif seq in frame_files:
+                decode_start = time.perf_counter()
+                frame = imread(frame_files[seq])
+                decode_time += time.perf_counter() - decode_start
+                process_frame(frame)
+            else:
+                process_frame(None, recorded.results(seq))
+            # Door events can also sound it from the GPIO callback in between
+            if gpio.buzzer_active and not buzzer_on:
+                buzzer_activations += 1
+            buzzer_on = gpio.buzzer_active
+
+            # main_loop steps the recording timers once per captured frame
+            for _ in range(max(1, seq - last_seq)):
+                if recorder.is_recording():
+                    system.manage_recording()
+            last_seq = seq
+
+            if decisions:
+                decisions.write(json.dumps({
+                    't': e['t'], 'seq': seq, 'probability': intrusion_system.last_probability,
+                    'buzzer': gpio.buzzer_active, 'recording': recorder.is_recording(),
+                    'awaiting_feedback': system.awaiting_feedback
+                }) + "\n")
+
+    # Image decoding is not part of the system under test
+    elapsed = time.perf_counter() - start - decode_time
+    if decisions:
+        decisions.close()
+
+    processed = len(samples['process_frame'])
+    return {
+        'trace': trace_dir,
+        'mode': 'live' if live else 'recorded',
+        'operation_mode': system.operation_mode,
+        'frames': processed,
+        'trace_seconds': events[-1]['t'] if events else 0.0,
+        'elapsed_seconds': elapsed,
+        'fps': processed / elapsed if elapsed else 0.0,
+        'stages': {name: summarize(values) for name, values in samples.items()},
+        'decisions': {
+            'buzzer_activations': buzzer_activations,
+            'recordings': dict(recorder.started),
+            'logs': dict(ws.logs),
+            'feedback_requests': ws.messages['feedback_request'],
+            'probability_messages': ws.messages['probability']
+        },
+        'scheduler': system.scheduler.get_stats()
+    }
+
+
+def print_report(report):
+    print(f"[Replay] {report['trace']} ({report['mode']}, {report['operation_mode']} mode): "
+          f"{report['frames']} frames in {report['elapsed_seconds']:.2f}s, {report['fps']:.1f} fps "
+          f"({report['trace_seconds']:.1f}s of recording)")
+    for name, stats in report['stages'].items():
+        if stats['calls']:
+            print(f"  {name}: {stats['calls']} calls, p50 {stats['p50_ms']:.2f}ms, "
+                  f"p95 {stats['p95_ms']:.2f}ms, p99 {stats['p99_ms']:.2f}ms, max {stats['max_ms']:.2f}ms")
+    decisions = report['decisions']
+    print(f"  buzzer activations: {decisions['buzzer_activations']}, "
+          f"recordings: {decisions['recordings']}, feedback requests: {decisions['feedback_requests']}")
+    print(f"  logs: {decisions['logs']}")
+    gates = report['scheduler']['gates']
+    print(f"  scheduler: {report['scheduler']['wakeups']} wakeups, "
+          + ", ".join(f"{name} {g['runs']} run/{g['skips']} skipped" for name, g in gates.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded sensor traces through MainSystem")
+    parser.add_argument('traces', nargs='+', help="trace directories recorded with TRACE_DIR")
+    parser.add_argument('--live', action='store_true',
+                        help="run the camera stages on the recorded frames instead of using recorded results")
+    parser.add_argument('--mode', choices=['learning', 'confidence', 'normal'],
+                        help="operation mode to replay in (default: the recorded one)")
+    parser.add_argument('--decisions', help="write per-frame decisions to this JSONL file")
+    parser.add_argument('--json', help="write the report(s) to this file")
+    args = parser.parse_args()
+
+    if args.decisions and len(args.traces) > 1:
+        sys.exit("--decisions takes a single trace")
+
+    reports = []
+    for trace_dir in args.traces:
+        report = replay(trace_dir, live=args.live, operation_mode=args.mode, decisions_path=args.decisions)
+        print_report(report)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
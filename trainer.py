@@ -0,0 +1,106 @@
+import os
+import queue
+import threading
+import time
+
+
+class Trainer:
+    """
+    Background worker that runs online training off the WebSocket loop.
+
+    Feedback labels are queued with submit(); the worker trains on them in
+    order and publishes the new weights to the detection path. Saves are
+    debounced: the system is written to disk once no save has happened for
+    `save_delay` seconds since the first unsaved label.
+    """
+
+    def __init__(self, intrusion_system):
+        self.intrusion_system = intrusion_system
+        self.queue = queue.Queue(maxsize=int(os.getenv('TRAINER_QUEUE_SIZE', 32)))
+        self.save_delay = float(os.getenv('TRAINER_SAVE_DELAY', 10.0))
+
+        self.running = False
+        self.thread = None
+        self.dirty_since = None
+
+        self.jobs_done = 0
+        self.jobs_dropped = 0
+        self.saves = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        print("Trainer started")
+
+    def submit(self, features, label):
+        try:
+            self.queue.put_nowait((features, label))
+            return True
+        except queue.Full:
+            self.jobs_dropped += 1
+            print(f"[Trainer] Queue full, dropped label={label}")
+            return False
+
+    def _run(self):
+        while self.running or not self.queue.empty():
+            try:
+                features, label = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                self._maybe_save()
+                continue
+
+            start = time.perf_counter()
+            try:
+                self.intrusion_system.train_features(features, label)
+            except Exception as e:
+                print(f"[Trainer] Training error: {e}")
+                continue
+            finally:
+                self.queue.task_done()
+
+            self.last_latency = time.perf_counter() - start
+            self.total_latency += self.last_latency
+            self.jobs_done += 1
+
+            if self.dirty_since is None:
+                self.dirty_since = time.monotonic()
+            self._maybe_save()
+
+    def _maybe_save(self, force=False):
+        if self.dirty_since is None:
+            return
+        if not force and time.monotonic() - self.dirty_since < self.save_delay:
+            return
+
+        try:
+            self.intrusion_system.save()
+            self.saves += 1
+        except Exception as e:
+            print(f"[Trainer] Save error: {e}")
+        self.dirty_since = None
+
+    def get_stats(self):
+        mean_latency = self.total_latency / self.jobs_done if self.jobs_done else 0.0
+        return {
+            'queue_depth': self.queue.qsize(),
+            'jobs_done': self.jobs_done,
+            'jobs_dropped': self.jobs_dropped,
+            'saves': self.saves,
+            'pending_save': self.dirty_since is not None,
+            'last_latency_ms': self.last_latency * 1000,
+            'mean_latency_ms': mean_latency * 1000
+        }
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=30)
+            if self.thread.is_alive():
+                # Saving now would race the training step still in progress
+                print("[Trainer] Still training after 30s, skipping final save")
+                return
+        self._maybe_save(force=True)
+        print("Trainer stopped")
@@ -1,20 +1,149 @@
 import asyncio
+import contextlib
 import websockets
 import json
 import os
+import time
+import threading
+from collections import deque
 from dotenv import load_dotenv
+import metrics
+from telemetry import telemetry_schema
 
 load_dotenv()
 
+LOG_BATCH_PREFIX = '{"jsonType": "log_batch", "logs": ['
+
+class ClientChannel:
+    """
+    Bounded outbound queue for one client, drained by its own writer task.
+
+    Messages arrive already serialized. A new probability or metrics
+    message replaces one that is still queued (the old value is stale), and
+    on each drain runs of consecutive log messages go out as one log_batch
+    frame. When the queue is full the oldest log, probability or metrics
+    message is dropped, so a slow client only ever falls behind by max_size
+    messages and never holds up the others.
+
+    Clients that subscribed to telemetry also receive binary frames; queued
+    ticks are sent together as one frame of back-to-back records and are
+    the first thing dropped when the queue is full.
+    """
+
+    def __init__(self, websocket, max_size, batch_delay):
+        self.websocket = websocket
+        self.address = websocket.remote_address
+        self.max_size = max_size
+        self.batch_delay = batch_delay
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.telemetry = False
+        self.closed = False
+        # Sends all run on the event loop thread, so the histogram needs no lock
+        self.send_latency = metrics.histogram('ws_broadcast') if metrics.ENABLED else None
+        
+        self.sent = 0
+        self.batches = 0
+        self.dropped = 0
+        self.stale = 0
+
+    def _remove_first(self, kinds):
+        for i, (kind, _) in enumerate(self.queue):
+            if kind in kinds:
+                del self.queue[i]
+                return True
+        return False
+
+    def enqueue(self, kind, text):
+        if self.closed:
+            return
+        if kind in ('probability', 'metrics') and self._remove_first((kind,)):
+            self.stale += 1
+        elif len(self.queue) >= self.max_size:
+            if not self._remove_first(('telemetry', 'log', 'probability', 'metrics')):
+                self.queue.popleft()
+            self.dropped += 1
+        self.queue.append((kind, text))
+        self.ready.set()
+
+    def _frames(self, items):
+        frames = []
+        run_kind = None
+        run = []
+        for kind, data in items:
+            if kind in ('log', 'telemetry') and kind == run_kind:
+                run.append(data)
+                continue
+            if run:
+                frames.append(self._run_frame(run_kind, run))
+            if kind in ('log', 'telemetry'):
+                run_kind, run = kind, [data]
+            else:
+                run_kind, run = None, []
+                frames.append(data)
+        if run:
+            frames.append(self._run_frame(run_kind, run))
+        return frames
+
+    def _run_frame(self, kind, run):
+        if kind == 'telemetry':
+            return b"".join(run)
+        return self._log_frame(run)
+
+    def _log_frame(self, logs):
+        if len(logs) == 1:
+            return logs[0]
+        self.batches += 1
+        return LOG_BATCH_PREFIX + ", ".join(logs) + "]}"
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            # Let a burst of logs from the same frame land in one batch
+            if self.batch_delay and self.queue and self.queue[-1][0] == 'log':
+                await asyncio.sleep(self.batch_delay)
+            self.ready.clear()
+            
+            items = list(self.queue)
+            self.queue.clear()
+            for frame in self._frames(items):
+                start = time.perf_counter()
+                try:
+                    await self.websocket.send(frame)
+                except websockets.exceptions.ConnectionClosed:
+                    # The reader loop sees the close too and removes the client
+                    self.closed = True
+                    self.queue.clear()
+                    return
+                if self.send_latency:
+                    self.send_latency.observe(time.perf_counter() - start)
+                self.sent += 1
+
+    def get_stats(self):
+        return {
+            'queue_depth': len(self.queue),
+            'sent': self.sent,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'stale_dropped': self.stale
+        }
+
 class WebSocketServer:
     def __init__(self, on_message_callback):
         self.host = os.getenv('WEBSOCKET_HOST', '0.0.0.0')
         self.port = int(os.getenv('WEBSOCKET_PORT', 8765))
+        self.queue_size = int(os.getenv('WS_CLIENT_QUEUE_SIZE', 64))
+        self.batch_delay = float(os.getenv('WS_LOG_BATCH_MS', 20)) / 1000
         self.on_message_callback = on_message_callback
-        self.clients = set()
+        self.clients = {}
         self.server = None
         self.running = False
         self.loop = None
+        
+        # send() only serializes and queues; it is called from the main loop
+        # and from message handlers. The socket writes are timed per channel
+        self.send = metrics.timed('ws_enqueue', self.send, shared=True)
+        self.send_telemetry = metrics.timed('ws_telemetry', self.send_telemetry)
 
     def start(self):
         self.running = True
@@ -30,47 +159,69 @@ class WebSocketServer:
             print(f"WebSocket server listening on {self.host}:{self.port}")
             await asyncio.Future()
         
-        import threading
         self.thread = threading.Thread(target=lambda: self.loop.run_until_complete(run_server()), daemon=True)
         self.thread.start()
 
     async def _handle_client(self, websocket, path):
-        self.clients.add(websocket)
+        channel = ClientChannel(websocket, self.queue_size, self.batch_delay)
+        writer = asyncio.ensure_future(channel.run())
+        self.clients[websocket] = channel
         print(f"Client connected: {websocket.remote_address}")
         
         try:
             async for message in websocket:
                 try:
                     data = json.loads(message)
-                    if self.on_message_callback:
+                    if data.get('jsonType') in ('subscribe', 'unsubscribe'):
+                        self._handle_subscription(channel, data)
+                    elif self.on_message_callback:
                         self.on_message_callback(data)
                 except Exception as e:
                     print(f"Message parse error: {e}")
         except websockets.exceptions.ConnectionClosed:
             pass
         finally:
-            self.clients.remove(websocket)
+            writer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await writer
+            self.clients.pop(websocket, None)
             print(f"Client disconnected: {websocket.remote_address}")
 
+    def _handle_subscription(self, channel, data):
+        if data.get('stream') != 'telemetry':
+            return
+        channel.telemetry = data['jsonType'] == 'subscribe'
+        if channel.telemetry:
+            channel.enqueue('telemetry_schema', json.dumps(telemetry_schema()))
+        print(f"Client {channel.address} {'subscribed to' if channel.telemetry else 'unsubscribed from'} telemetry")
+
+    def _enqueue(self, kind, text):
+        for channel in self.clients.values():
+            channel.enqueue(kind, text)
+
+    def _enqueue_telemetry(self, record):
+        for channel in self.clients.values():
+            if channel.telemetry:
+                channel.enqueue('telemetry', record)
+
+    def has_telemetry_subscribers(self):
+        return any(channel.telemetry for channel in list(self.clients.values()))
+
+    def send_telemetry(self, record):
+        """Queue one packed telemetry record for subscribed clients only."""
+        if self.loop and self.running:
+            self.loop.call_soon_threadsafe(self._enqueue_telemetry, record)
+
     def send(self, data):
-        if not self.clients:
+        if not self.clients or not (self.loop and self.running):
             return
         
+        # Serialized once here, shared by every client queue
         message = json.dumps(data)
-        
-        async def broadcast():
-            disconnected = set()
-            for client in self.clients:
-                try:
-                    await client.send(message)
-                except Exception:
-                    disconnected.add(client)
-            
-            for client in disconnected:
-                self.clients.discard(client)
-        
-        if self.loop and self.running:
-            asyncio.run_coroutine_threadsafe(broadcast(), self.loop)
+        self.loop.call_soon_threadsafe(self._enqueue, data.get('jsonType'), message)
+
+    def get_stats(self):
+        return {str(channel.address): channel.get_stats() for channel in list(self.clients.values())}
 
     def stop(self):
         self.running = False
@@ -80,8 +231,8 @@ class WebSocketServer:
                 self.server.close()
                 await self.server.wait_closed()
             
-            for client in list(self.clients):
-                await client.close()
+            for websocket in list(self.clients):
+                await websocket.close()
             
             self.clients.clear()
         
@@ -92,4 +243,3 @@ class WebSocketServer:
             self.thread.join(timeout=2)
         
         print("WebSocket server stopped")
-